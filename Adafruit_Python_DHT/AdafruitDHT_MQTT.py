@@ -4,92 +4,115 @@ import sys
 import Adafruit_DHT
 import paho.mqtt.client as mqtt
 import json
-import math
+import os
 import time
 import uuidgen
+import outbox
+import dhtsampler
+import filters
+import derived
 
 
-# Define a class NanError derived from super class Exception for use in raising Nan errors.
+# The DHT sensors to sample, as name: (sensor type, pin). Each publishes under
+# the UUID generated for its name; the unnamed sensor keeps the device's UUID.
+SENSORS = {'': (Adafruit_DHT.AM2302, 4)}
 
 
-class NanError(Exception):
-    pass
+def dht_pipeline():
+    # Smooths the samples taken between publishes; failed reads have already been dropped.
+    return filters.Fields(temperature=filters.Kalman(0.01, 0.5), humidity=filters.Kalman(0.05, 2.0))
 
 
-# Define a class ZeroError derived from super class Exception for use in raising errors when
-# temp/humidity both return 0.
+# Set to True to see debug statements like nan error, False to hide.
+debug = False
 
+uuids = dict((name, uuidgen.generateUuid(name)) for name in SENSORS)
 
-class ZeroError(Exception):
-    pass
+# Fields derived from the temperature and humidity and published with them, so
+# subscribers need not compute them from every message.
+derive = derived.Derive(["temperature_f", "dewpoint_c", "dewpoint_f", "heat_index_c"])
 
+scale = 'F'         # Scale for temperature, C or F.
+symbol = u'\u2103'  # Unicode degrees C.
 
-sensor = Adafruit_DHT.AM2302
-pin = 4
+# Readings are stored on disk until the broker acknowledges them, so none are
+# lost while it is unreachable.
+OUTBOX = outbox.Outbox(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'outbox.dat'))
 
-# Set to True to see debug statements like nan error, False to hide.
-debug = False
+# Readings are published from the sampler's cache every PUBLISH_INTERVAL
+# seconds. A sensor whose last good reading is older than MAX_AGE is skipped
+# rather than publishing a stale value as new.
+PUBLISH_INTERVAL = 60
+MAX_AGE = 120
+# Between publishes the outbox is drained at least this often, so that
+# acknowledgements are applied and a backlog is replayed at the outbox's rate.
+DRAIN_INTERVAL = 1.0
 
-uuid = uuidgen.generateUuid()
 
-scale = 'F'         # Scale for temperature, C or F.
-symbol = u'\u2103'  # Unicode degrees C.
+def on_connect(client, userdata, flags, rc):
+    OUTBOX.on_connect()
+
+
+def on_disconnect(client, userdata, rc):
+    OUTBOX.on_disconnect()
+
+
+def on_publish(client, userdata, mid):
+    OUTBOX.on_publish(mid)
+
 
 # Initialize MQTT connections.
 remote_client = mqtt.Client()
+remote_client.on_connect = on_connect
+remote_client.on_disconnect = on_disconnect
+remote_client.on_publish = on_publish
+# Connect in the background, so that the broker being down at start is
+# retried while readings wait in the outbox.
+remote_client.connect_async('test.mosquitto.org')
 remote_client.loop_start()
-remote_client.connect('test.mosquitto.org')
+
+sampler = dhtsampler.DhtSampler(Adafruit_DHT.read, SENSORS,
+                                dict((name, dht_pipeline()) for name in SENSORS))
+sampler.start()
 
 try:
+    # Publish first once every sensor has had a chance at a reading.
+    next_publish = time.time() + max(dhtsampler.MIN_INTERVAL.get(sensor, 2.0) for sensor, pin in SENSORS.values())
     while True:
-
-        try:
-            # Try to grab a sensor reading.  Use the read_retry method which will retry up
-            # to 15 times to get a sensor reading (waiting 2 seconds between each retry).
-            hum, tempc = Adafruit_DHT.read_retry(sensor, pin)
-
-            # check if we have nans
-            # if so, then raise a locally defined NanError exception
-            # if math.isnan(tempc) is True or math.isnan(hum) is True:
-            #    raise NanError('nan error')
-
-            # Note that sometimes you won't get a reading and
-            # the results will be null (because Linux can't
-            # guarantee the timing of calls to read the sensor).
-            # If this happens try again!
-            if hum is None and tempc is None:
-                raise NanError('none error')
-
-            # Check if both temp and humidity are zero
-            # if so, the raise a locally defined ZeroError exception
-            if tempc == 0.0 and hum == 0.0:
-                raise ZeroError('zero error')
-
-        except (NanError, ZeroError) as e:
-            if debug:
-                print str(e)
-            # Do nothing and retry after short delay.
-            time.sleep(0.25)
+        now = time.time()
+        if now < next_publish:
+            OUTBOX.drain(remote_client)
+            wait = OUTBOX.time_until_drain()
+            time.sleep(min(next_publish - now, DRAIN_INTERVAL if wait is None else wait))
             continue
+        next_publish += PUBLISH_INTERVAL
 
-        print '\nTemp:', "{0:.1f}".format(tempc) + u'\u2103'  # Unicode degrees C.
-
-        if scale == 'F':
-            temp = tempc * 9 / 5 + 32
-            symbol = u'\u2109'  # Unicode degrees F.
-            print 'Temp:', "{0:.1f}".format(temp) + symbol
-        else:
-            temp = tempc
-
-        print 'Humi:', "{0:.1f}".format(hum) + '%'
-
-        # Publish to MQTT.
-        publish_data = {"timestamp": int(time.time() * 1000),
-                        "data": {"temperature": "{0:.1f}".format(tempc), "humidity": "{0:.1f}".format(hum)}}
-        remote_client.publish('SNHU/IT697/sensor/data/' + uuid, json.dumps(publish_data))
-
-        # Delay between updates.
-        time.sleep(60)
+        readings = sampler.latest(MAX_AGE)
+        if debug:
+            for name in sorted(SENSORS):
+                if name not in readings:
+                    print 'No recent reading from sensor', repr(name), '(%d errors)' % sampler.errors[name]
+
+        for name, reading in sorted(readings.items()):
+            hum, tempc = reading.humidity, reading.temperature
+            print '\nTemp:', "{0:.1f}".format(tempc) + u'\u2103'  # Unicode degrees C.
+
+            if scale == 'F':
+                temp = derived.fahrenheit(tempc)
+                symbol = u'\u2109'  # Unicode degrees F.
+                print 'Temp:', "{0:.1f}".format(temp) + symbol
+            else:
+                temp = tempc
+
+            print 'Humi:', "{0:.1f}".format(hum) + '%'
+
+            # Publish to MQTT, stamped with the time the reading was taken.
+            data = derive.process({"temperature": tempc, "humidity": hum})
+            publish_data = {"timestamp": int(reading.timestamp * 1000),
+                            "data": dict((key, "{0:.1f}".format(value)) for key, value in data.items())}
+            OUTBOX.append('SNHU/IT697/sensor/data/' + uuids[name], json.dumps(publish_data))
+        OUTBOX.drain(remote_client)
 
         # Keep line spacing consistent in debug mode.
         if debug:
@@ -100,4 +123,9 @@ except KeyboardInterrupt as e:
         print type(e)
 
 finally:
+    sampler.stop()
+    OUTBOX.drain(remote_client)
+    remote_client.disconnect()
+    remote_client.loop_stop()
+    OUTBOX.close()
     print "Exiting"
@@ -0,0 +1,111 @@
+"""
+Derives further values from temperature and humidity readings on the device,
+once per reading, so that subscribers such as Node-RED flows need not compute
+them for every message. Which fields are added is configurable, and they are
+named as the Node-RED flows name them:
+
+    Derive(["temperature_f", "dewpoint_c"]).process(
+        {"temperature": 19.0, "humidity": 47.0})
+    -> {"temperature": 19.0, "humidity": 47.0, "temperature_f": 66.2,
+        "dewpoint_c": 7.4}
+
+Temperatures are in degrees C, humidity is relative humidity in percent. The
+dew point uses the Magnus formula rather than the flows' T - (100 - RH) / 5
+approximation, which is only close above 50% relative humidity.
+"""
+
+import math
+import numbers
+
+
+def fahrenheit(celsius):
+    return celsius * 9.0 / 5 + 32
+
+
+def dew_point(celsius, humidity):
+    """ Returns the dew point in degrees C, by the Magnus formula """
+    gamma = math.log(humidity / 100.0) + 17.62 * celsius / (243.12 + celsius)
+    return 243.12 * gamma / (17.62 - gamma)
+
+
+def heat_index(celsius, humidity):
+    """ Returns the heat index in degrees C, by the US National Weather
+    Service's method
+    """
+    t = fahrenheit(celsius)
+    index = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + humidity * 0.094)
+    if (index + t) / 2 >= 80:
+        index = (-42.379 + 2.04901523 * t + 10.14333127 * humidity -
+                 0.22475541 * t * humidity - 0.00683783 * t * t -
+                 0.05481717 * humidity * humidity +
+                 0.00122874 * t * t * humidity +
+                 0.00085282 * t * humidity * humidity -
+                 0.00000199 * t * t * humidity * humidity)
+        if humidity < 13 and 80 <= t <= 112:
+            index -= ((13 - humidity) / 4.0 *
+                      math.sqrt((17 - abs(t - 95)) / 17.0))
+        elif humidity > 85 and 80 <= t <= 87:
+            index += (humidity - 85) / 10.0 * (87 - t) / 5.0
+    return (index - 32) * 5.0 / 9
+
+
+def absolute_humidity(celsius, humidity):
+    """ Returns the absolute humidity in grams of water per cubic metre """
+    return (6.112 * math.exp(17.67 * celsius / (celsius + 243.5)) *
+            humidity * 2.1674 / (273.15 + celsius))
+
+
+# Each field that can be derived, as (the fields it is derived from, the
+# function deriving it)
+DERIVATIONS = {
+    "temperature_c": (("temperature",), float),
+    "temperature_f": (("temperature",), fahrenheit),
+    "dewpoint_c": (("temperature", "humidity"), dew_point),
+    "dewpoint_f": (("temperature", "humidity"),
+                   lambda t, h: fahrenheit(dew_point(t, h))),
+    "heat_index_c": (("temperature", "humidity"), heat_index),
+    "heat_index_f": (("temperature", "humidity"),
+                     lambda t, h: fahrenheit(heat_index(t, h))),
+    "absolute_humidity": (("temperature", "humidity"), absolute_humidity)
+}
+
+DEFAULT_FIELDS = ("temperature_f", "dewpoint_c", "dewpoint_f", "heat_index_c")
+
+
+class Derive(object):
+    __slots__ = ("fields", "digits")
+
+    def __init__(self, fields=DEFAULT_FIELDS, digits=1):
+        """
+        :param fields: The names of the fields to add, from DERIVATIONS
+        :param digits: The number of decimal places derived values are
+        rounded to
+        """
+        unknown = [name for name in fields if name not in DERIVATIONS]
+        if unknown:
+            raise ValueError("unknown derived fields %s" % ", ".join(unknown))
+        self.fields = tuple(fields)
+        self.digits = digits
+
+    def process(self, sample):
+        """ Adds the derived fields to a reading. A field is left out when
+        a value it is derived from is missing, is not a number or is out of
+        range, such as a humidity of 0.
+        :param sample: A dict reading; anything else is returned unchanged
+        :return: A copy of the reading with the derived fields added
+        """
+        if not isinstance(sample, dict):
+            return sample
+        derived = dict(sample)
+        for name in self.fields:
+            inputs, derive = DERIVATIONS[name]
+            values = [sample.get(field) for field in inputs]
+            if not all(isinstance(value, numbers.Number) and
+                       not isinstance(value, bool) and value == value
+                       for value in values):
+                continue
+            try:
+                derived[name] = round(derive(*values), self.digits)
+            except (ValueError, ZeroDivisionError, OverflowError):
+                continue
+        return derived
@@ -0,0 +1,126 @@
+"""
+Samples several DHT sensors in the background. Each sensor has its own worker
+thread that reads it once per its minimum sampling interval with a single
+attempt, backing off while the reads fail, and keeps the last good reading
+with the time it was taken. Readings are checked, and can be smoothed, by a
+filters pipeline per sensor. Publishers read that cache on their own schedule,
+so a sensor that stops answering never holds up the others or the publisher.
+
+Adafruit_DHT.read_retry is deliberately not used: it retries up to 15 times,
+two seconds apart, blocking its caller for up to 30 seconds.
+"""
+
+import collections
+import threading
+import time
+
+import filters
+
+# The shortest time between reads each sensor type supports, keyed by the
+# Adafruit_DHT sensor constants: DHT11 is 11, DHT22 and AM2302 are 22, and
+# AM2301 is 21.
+MIN_INTERVAL = {11: 1.0, 21: 2.0, 22: 2.0}
+
+Reading = collections.namedtuple("Reading", "humidity temperature timestamp")
+
+
+def reject_pipeline():
+    """ Returns a pipeline that drops failed reads. Linux cannot guarantee the
+    timing the sensor needs, so reads often fail with None; NaN is also
+    reported, and a failed read can return zero for both values, which shows
+    as an impossible zero humidity.
+    """
+    return filters.Fields(temperature=filters.Reject(),
+                          humidity=filters.Reject(zero=True))
+
+
+class DhtSampler(object):
+    def __init__(self, read, sensors, pipelines=None, max_backoff=30.0,
+                 clock=time.time):
+        """
+        :param read: Called with (sensor type, pin) for one attempt at a
+        reading, returning (humidity, temperature), e.g. Adafruit_DHT.read
+        :param sensors: A dict of sensor name to (sensor type, pin)
+        :param pipelines: A dict of sensor name to a filters pipeline its
+        {"temperature", "humidity"} readings are run through once failed
+        reads have been rejected, such as smoothing, or None
+        :param max_backoff: The longest wait in seconds between failing reads
+        """
+        self.read = read
+        self.sensors = sensors
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.pipelines = {}
+        for name in sensors:
+            pipeline = (pipelines or {}).get(name)
+            self.pipelines[name] = reject_pipeline() if pipeline is None else \
+                filters.Pipeline(reject_pipeline(), pipeline)
+        self.readings = {}
+        self.errors = dict((name, 0) for name in sensors)
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def sample(self, name):
+        """ Makes one attempt at reading a sensor, caching the reading if it
+        is good
+        :param name: The sensor name
+        :return: True if the reading was good
+        """
+        sensor, pin = self.sensors[name]
+        try:
+            hum, tempc = self.read(sensor, pin)
+        except (IOError, RuntimeError):
+            hum = tempc = None
+        reading = self.pipelines[name].process({"temperature": tempc,
+                                                "humidity": hum})
+        if reading is None:
+            with self.lock:
+                self.errors[name] += 1
+            return False
+        with self.lock:
+            self.readings[name] = Reading(reading["humidity"],
+                                          reading["temperature"], self.clock())
+        return True
+
+    def run(self, name):
+        interval = MIN_INTERVAL.get(self.sensors[name][0], 2.0)
+        delay = interval
+        while not self.stopping.is_set():
+            if self.sample(name):
+                delay = interval
+            else:
+                # The sensor still needs its interval after a failed read;
+                # beyond that, back off while it keeps failing.
+                delay = min(delay * 2, self.max_backoff)
+            self.stopping.wait(delay)
+
+    def latest(self, max_age=None):
+        """ Returns the last good reading of each sensor
+        :param max_age: Leave out readings older than this many seconds, or
+        None to include them all
+        :return: A dict of sensor name to Reading
+        """
+        with self.lock:
+            readings = dict(self.readings)
+        if max_age is not None:
+            now = self.clock()
+            readings = dict((name, reading)
+                            for name, reading in readings.items()
+                            if now - reading.timestamp <= max_age)
+        return readings
+
+    def start(self):
+        self.stopping.clear()
+        for name in sorted(self.sensors):
+            thread = threading.Thread(target=self.run, args=(name,),
+                                      name="dht-" + str(name))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
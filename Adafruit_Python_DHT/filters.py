@@ -0,0 +1,265 @@
+"""
+Filters for noisy sensor readings. A filter takes one sample at a time through
+process(sample) and returns the filtered value, or None when the sample is
+rejected, so that a bad reading never reaches change detection. Filters are
+chained into a Pipeline, and Fields applies a pipeline to each field of a
+sensor that returns a dict, such as the DHT sensor:
+
+    dht = Pipeline(Fields(temperature=Reject(), humidity=Reject(zero=True)),
+                   Fields(temperature=Kalman(0.01, 0.5), humidity=EMA(0.3)))
+
+The smoothing filters expect numbers, so Reject goes first for a sensor whose
+reads can fail. Every filter keeps a few numbers of state per sensor and costs
+constant time per sample, except MedianFilter, which costs O(log window).
+"""
+
+import bisect
+import numbers
+import time
+
+
+def valid(sample):
+    """ Returns whether a sample is a number other than NaN """
+    if isinstance(sample, bool) or not isinstance(sample, numbers.Number):
+        return False
+    return sample == sample
+
+
+class MedianFilter(object):
+    """ A rolling median with outlier rejection and a plausibility range,
+    for sensors such as the ultrasonic ranger that report occasional spikes
+    and timeouts.
+
+    Samples outside [minimum, maximum] are always rejected. A sample further
+    than max_deviation from the current median is rejected as an outlier,
+    unless it is the persistence-th such sample in a row, in which case the
+    reading has really changed and it is accepted. Accepted samples go into a
+    ring buffer of the last window samples, mirrored by a sorted list, so each
+    sample costs an O(log n) search and a short list move.
+    """
+    __slots__ = ("window", "minimum", "maximum", "max_deviation",
+                 "persistence", "ring", "ordered", "head", "outliers",
+                 "rejected")
+
+    def __init__(self, window=5, minimum=None, maximum=None,
+                 max_deviation=None, persistence=3):
+        """
+        :param window: The number of samples the median is taken over, best
+        odd
+        :param minimum: The lowest plausible sample, or None for no limit
+        :param maximum: The highest plausible sample, or None for no limit
+        :param max_deviation: The furthest a sample may be from the median
+        before it is an outlier, or None not to reject outliers
+        :param persistence: Outliers in a row after which they are accepted
+        """
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.window = window
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_deviation = max_deviation
+        self.persistence = persistence
+        self.ring = []
+        self.ordered = []
+        self.head = 0
+        self.outliers = 0
+        self.rejected = 0
+
+    def median(self):
+        """ Returns the current median, or None before the first sample """
+        if not self.ordered:
+            return None
+        return self.ordered[len(self.ordered) // 2]
+
+    def plausible(self, sample):
+        if not valid(sample):
+            return False
+        if self.minimum is not None and sample < self.minimum:
+            return False
+        if self.maximum is not None and sample > self.maximum:
+            return False
+        return True
+
+    def process(self, sample):
+        """ Filters a sample
+        :param sample: The raw reading
+        :return: The median of the recent accepted samples, or None if the
+        sample was rejected
+        """
+        if not self.plausible(sample):
+            self.rejected += 1
+            return None
+        median = self.median()
+        if (self.max_deviation is not None and median is not None and
+                abs(sample - median) > self.max_deviation):
+            self.outliers += 1
+            if self.outliers < self.persistence:
+                self.rejected += 1
+                return None
+            # The reading has moved; start the window again from here
+            del self.ring[:]
+            del self.ordered[:]
+            self.head = 0
+        self.outliers = 0
+        if len(self.ring) < self.window:
+            self.ring.append(sample)
+        else:
+            oldest = self.ring[self.head]
+            del self.ordered[bisect.bisect_left(self.ordered, oldest)]
+            self.ring[self.head] = sample
+            self.head = (self.head + 1) % self.window
+        bisect.insort(self.ordered, sample)
+        return self.median()
+
+
+class Reject(object):
+    """ Rejects samples that are not numbers, such as None from a failed read,
+    and NaN. Zero can be rejected too, for sensors such as the DHT that report
+    zero when a read fails.
+    """
+    __slots__ = ("zero",)
+
+    def __init__(self, zero=False):
+        """
+        :param zero: Whether zero samples are rejected
+        """
+        self.zero = zero
+
+    def process(self, sample):
+        if not valid(sample) or (self.zero and sample == 0):
+            return None
+        return sample
+
+
+class EMA(object):
+    """ An exponential moving average """
+    __slots__ = ("alpha", "value")
+
+    def __init__(self, alpha=0.3):
+        """
+        :param alpha: The weight of each new sample, from 0 to 1; smaller is
+        smoother but slower to follow a change
+        """
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.value = None
+
+    def process(self, sample):
+        if self.value is None:
+            self.value = sample
+        else:
+            self.value += self.alpha * (sample - self.value)
+        return self.value
+
+
+class Kalman(object):
+    """ A scalar Kalman filter for a reading that holds steady or drifts
+    slowly, such as temperature. Unlike an EMA, how much each sample counts
+    follows from the noise of the sensor and how fast the reading may drift.
+    """
+    __slots__ = ("process_variance", "measurement_variance", "estimate",
+                 "error")
+
+    def __init__(self, process_variance=0.01, measurement_variance=1.0):
+        """
+        :param process_variance: How much the true reading may drift between
+        samples, as a variance
+        :param measurement_variance: The sensor's noise, as a variance
+        """
+        self.process_variance = process_variance
+        self.measurement_variance = measurement_variance
+        self.estimate = None
+        self.error = measurement_variance
+
+    def process(self, sample):
+        if self.estimate is None:
+            self.estimate = float(sample)
+            return self.estimate
+        error = self.error + self.process_variance
+        gain = error / (error + self.measurement_variance)
+        self.estimate += gain * (sample - self.estimate)
+        self.error = (1 - gain) * error
+        return self.estimate
+
+
+class RateLimit(object):
+    """ Limits how fast a reading may change, so a glitch moves it only a
+    little while a real change is followed at the limited rate
+    """
+    __slots__ = ("max_rate", "clock", "value", "time")
+
+    def __init__(self, max_rate, clock=time.time):
+        """
+        :param max_rate: The most the reading may change per second
+        """
+        self.max_rate = max_rate
+        self.clock = clock
+        self.value = None
+        self.time = None
+
+    def process(self, sample):
+        now = self.clock()
+        if self.value is not None:
+            step = self.max_rate * (now - self.time)
+            sample = max(self.value - step, min(self.value + step, sample))
+        self.value = sample
+        self.time = now
+        return sample
+
+
+class Round(object):
+    """ Rounds readings, so smoothed values are published no more precisely
+    than the sensor measures
+    """
+    __slots__ = ("digits",)
+
+    def __init__(self, digits=1):
+        self.digits = digits
+
+    def process(self, sample):
+        return round(sample, self.digits)
+
+
+class Pipeline(object):
+    """ Runs a sample through filters in order, stopping at the first that
+    rejects it
+    """
+    __slots__ = ("stages",)
+
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def process(self, sample):
+        for stage in self.stages:
+            sample = stage.process(sample)
+            if sample is None:
+                return None
+        return sample
+
+
+class Fields(object):
+    """ Filters the fields of a dict sample, each with its own filter. The
+    sample is rejected if any field is; fields without a filter are passed
+    through. Fields filtered before a rejected one have already taken the
+    sample, so rejection belongs in a Fields stage of its own ahead of any
+    smoothing.
+    """
+    __slots__ = ("fields",)
+
+    def __init__(self, **fields):
+        """
+        :param fields: The filter for each field, by field name
+        """
+        self.fields = fields
+
+    def process(self, sample):
+        if not isinstance(sample, dict):
+            return None
+        filtered = dict(sample)
+        for name, stage in self.fields.items():
+            value = stage.process(sample.get(name))
+            if value is None:
+                return None
+            filtered[name] = value
+        return filtered
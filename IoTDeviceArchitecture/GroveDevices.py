@@ -3,50 +3,137 @@ A GroveDevice abstraction is created for each Grove Pi sensor and actuator. The
 GroveDevice provides a uniform read and write interface to each component and
 maintains a representation of each component's state. Additionally, each
 GroveDevice configures the underlying hardware as necessary for proper device
-operation.
+operation, on first use rather than when it is created, so that creating the
+devices costs no bus transactions.
 """
 
-import grovepi
-import grove_rgb_lcd
+import features
+import filters
+import grovebus
+import lcddriver
 import ports
 import math
+import threading
+import time
+
+# The Grove Pi is shared by the sensor loop and the actuator dispatcher, so
+# every call to the hardware goes through the bus manager one transaction at a
+# time. A slow sensor therefore only delays an actuator by one transaction.
+BUS = grovebus.BusManager()
 
 
 class GroveDevice(object):
-    def __init__(self, port=None, value=0):
+    # The pin mode set on first use, or None if the port needs none
+    MODE = None
+
+    def __init__(self, port=None, value=0, bus=None):
+        """
+        :param port: The port the device is connected to
+        :param value: The initial value
+        :param bus: The grovebus.BusManager the device is attached to, BUS if
+        None
+        """
         self.port = port
         self.value = value
+        self.bus = bus or BUS
+        # Incremented on every write so that changes can be detected without
+        # comparing values.
+        self.version = 0
+        self.configured = self.MODE is None
+        # A filter applied to readings by sample, see the filters module
+        self.pipeline = None
+
+    def setup(self):
+        """ Sets the pin mode if it has not been set yet
+        :return: None
+        """
+        if not self.configured:
+            self.bus.call("pinMode", self.port, self.MODE)
+            self.configured = True
+
+    def coerce(self, command):
+        """ Checks and converts a command before it is queued, so that only
+        commands the device can apply ever reach write
+        :param command: The command as received
+        :return: The command to write
+        :raise ValueError, TypeError: If the command is not valid
+        """
+        return command
 
     def read(self):
         return self.value
 
+    def sample(self):
+        """ Reads the device and runs the reading through its pipeline
+        :return: The filtered reading, or None if there is no reading or the
+        pipeline rejected it
+        """
+        value = self.read()
+        if value is None or self.pipeline is None:
+            return value
+        return self.pipeline.process(value)
+
     def write(self, value):
         self.value = value
+        self.version += 1
 
 
 class LED(GroveDevice):
-    def __init__(self, port=ports.D5):
-        GroveDevice.__init__(self, port)
-        grovepi.pinMode(port, ports.OUTPUT)
+    MODE = ports.OUTPUT
+
+    def __init__(self, port=ports.D5, bus=None):
+        GroveDevice.__init__(self, port, bus=bus)
+
+    def coerce(self, command):
+        return int(command)
 
     def write(self, value):
-        self.value = int(value)
-        grovepi.analogWrite(self.port, self.value)
+        value = int(value)
+        self.setup()
+        self.bus.call("analogWrite", self.port, value)
+        GroveDevice.write(self, value)
 
 
 class LCD(GroveDevice):
+    def __init__(self, port=ports.I2C_1, min_interval=0.1, bus=None):
+        """
+        :param min_interval: Fewest seconds between display refreshes
+        """
+        GroveDevice.__init__(self, port, bus=bus)
+        self.driver = lcddriver.FramebufferLCD(self.bus, min_interval)
+
+    def coerce(self, command):
+        """ Accepts a dict with a "text" string and/or an "rgb" triple """
+        if not isinstance(command, dict):
+            raise TypeError("LCD command must be a dict")
+        coerced = {}
+        if command.get("text") is not None:
+            coerced["text"] = unicode(command["text"])
+        if command.get("rgb") is not None:
+            rgb = tuple(int(channel) for channel in command["rgb"])
+            if len(rgb) != 3:
+                raise ValueError("rgb must have 3 channels")
+            coerced["rgb"] = rgb
+        return coerced
+
     def write(self, value):
-        self.value = value
-        try:
-            r, g, b = value["rgb"]
-            grove_rgb_lcd.setRGB(r, g, b)
-        except KeyError:
-            pass
-        try:
-            text = value["text"]
-            grove_rgb_lcd.setText(text)
-        except KeyError:
-            pass
+        self.driver.update(value.get("text"), value.get("rgb"))
+        GroveDevice.write(self, value)
+
+    def time_until_refresh(self):
+        return self.driver.time_until_refresh()
+
+    def refresh(self):
+        """ Sends changes held back by the refresh rate limit once it allows
+        :return: None
+        """
+        self.driver.refresh()
+
+    def flush(self):
+        """ Sends changes held back by the refresh rate limit immediately
+        :return: None
+        """
+        self.driver.flush()
 
 
 class DHTSensor(GroveDevice):
@@ -54,81 +141,218 @@ class DHTSensor(GroveDevice):
     DHT22 = 1
     DHT21 = 2
 
-    def __init__(self, port=ports.D7, dht_type=DHT11):
-        GroveDevice.__init__(self, port)
+    # The sensors cannot be sampled more often than this many seconds
+    MIN_INTERVAL = {DHT11: 1.0, DHT22: 2.0, DHT21: 2.0}
+
+    def __init__(self, port=ports.D7, dht_type=DHT11, backoff=0.1,
+                 max_backoff=30.0, ttl=60.0, clock=time.time, bus=None):
+        """
+        :param backoff: Seconds waited on top of the sensor's minimum
+        interval after the first failed attempt, doubling after each further
+        failure
+        :param max_backoff: Most seconds waited on top of the minimum interval
+        :param ttl: Seconds the last good reading is returned for once
+        fresh reads start failing
+        """
+        GroveDevice.__init__(self, port, None, bus)
         self.dht_type = dht_type
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ttl = ttl
+        self.clock = clock
+        self.min_interval = self.MIN_INTERVAL.get(dht_type, 2.0)
+        self.delay = backoff
+        self.next_attempt = None
+        self.last_good = None
+        # Whether the last attempt failed, so that the value returned is the
+        # last good reading rather than a fresh one; reported in the metrics
+        self.stale = False
+
+    def age(self):
+        """ Returns the age of the last good reading
+        :return: Seconds since the last good reading, or None if there is none
+        """
+        if self.last_good is None:
+            return None
+        return self.clock() - self.last_good
 
     def read(self):
-        while True:
-            temperature, humidity = grovepi.dht(self.port, self.dht_type)
-            # Sit here until we don't get NaN's.
-            if math.isnan(temperature) is False and math.isnan(humidity) is False:
-                break
-        self.value = {
-            "temperature": temperature,
-            "humidity": humidity
-        }
+        """ Reads the sensor if an attempt is due, never waiting for one: it
+        is called from the sensor loop every other sensor shares. A NaN
+        result puts the next attempt off by the sensor's minimum interval
+        plus a backoff that doubles while attempts keep failing. Until a
+        fresh reading is taken the last good one is returned, with stale set
+        after a failure, until it is older than the TTL and None is returned
+        instead.
+        :return: A dict of temperature and humidity, or None
+        """
+        now = self.clock()
+        if self.next_attempt is None or now >= self.next_attempt:
+            temperature, humidity = self.bus.call("dht", self.port,
+                                                  self.dht_type)
+            if math.isnan(temperature) or math.isnan(humidity):
+                self.next_attempt = now + self.min_interval + self.delay
+                self.delay = min(self.delay * 2, self.max_backoff)
+                self.stale = True
+            else:
+                self.value = {
+                    "temperature": temperature,
+                    "humidity": humidity
+                }
+                self.next_attempt = now + self.min_interval
+                self.delay = self.backoff
+                self.last_good = now
+                self.stale = False
+        if self.stale and self.last_good is not None and \
+                now - self.last_good > self.ttl:
+            self.value = None
         return self.value
 
 
 class AnalogSensor(GroveDevice):
-    def __init__(self, port):
-        GroveDevice.__init__(self, port)
+    def __init__(self, port, bus=None):
+        GroveDevice.__init__(self, port, bus=bus)
+
+    def read(self):
+        self.value = self.bus.call("analogRead", self.port)
+        return self.value
 
-        def read(self):
-            self.value = grovepi.analogRead(self.port)
-            return self.value
+
+class BurstSensor(AnalogSensor):
+    def __init__(self, port=ports.A0, samples=256, bands=4,
+                 max_error_rate=0.1, clock=time.time, bus=None):
+        """ An analog sensor read as a burst of samples taken as fast as the
+        bus allows, such as a sound sensor. Its value is the burst's features
+        rather than a single sample, see features.extract. Bursts are taken
+        on a worker thread, so the sensor loop is not held up for one.
+        :param samples: The number of samples in each burst
+        :param bands: The number of frequency bands to report the energy of
+        :param max_error_rate: The fraction of a burst's samples that may
+        fail before the burst is abandoned
+        """
+        AnalogSensor.__init__(self, port, bus=bus)
+        self.value = None
+        self.samples = features.buffer(samples)
+        self.bands = bands
+        self.max_errors = int(samples * max_error_rate)
+        self.clock = clock
+        self.burst = None
+
+    def read(self):
+        """ Starts a burst unless one is already being taken
+        :return: The features of the last complete burst, or None before the
+        first has completed
+        """
+        if self.burst is None or not self.burst.is_alive():
+            self.burst = threading.Thread(target=self.take_burst,
+                                          name="burst-%s" % self.port)
+            self.burst.daemon = True
+            self.burst.start()
+        return self.value
+
+    def take_burst(self):
+        samples = self.samples
+        taken = errors = 0
+        start = self.clock()
+        # Each sample is its own transaction, so other sensors and actuator
+        # writes are only held up by one sample at a time.
+        for i in range(len(samples)):
+            try:
+                samples[taken] = self.bus.call("analogRead", self.port)
+            except IOError as e:
+                # A failed sample is left out of the burst, which is only
+                # abandoned once too few samples are left to describe it.
+                errors += 1
+                if errors > self.max_errors:
+                    print("Error", "burst", self.port, e)
+                    return
+                continue
+            taken += 1
+        elapsed = max(self.clock() - start, 1e-6)
+        self.value = features.extract(samples[:taken], taken / elapsed,
+                                      self.bands)
 
 
 class Potentiometer(AnalogSensor):
-    def __init__(self, port=ports.A2):
-        AnalogSensor.__init__(self, port)
+    def __init__(self, port=ports.A2, bus=None):
+        AnalogSensor.__init__(self, port, bus=bus)
 
 
 class LightSensor(AnalogSensor):
-    def __init__(self, port=ports.A1):
-        AnalogSensor.__init__(self, port)
+    def __init__(self, port=ports.A1, bus=None):
+        AnalogSensor.__init__(self, port, bus=bus)
 
 
 class SoundSensor(AnalogSensor):
-    def __init__(self, port=ports.A0):
-        AnalogSensor.__init__(self, port)
+    def __init__(self, port=ports.A0, bus=None):
+        AnalogSensor.__init__(self, port, bus=bus)
 
 
 class Button(GroveDevice):
-    def __init__(self, port=ports.D3):
-        GroveDevice.__init__(self, port)
-        grovepi.pinMode(port, ports.INPUT)
+    MODE = ports.INPUT
+
+    def __init__(self, port=ports.D3, bus=None):
+        GroveDevice.__init__(self, port, bus=bus)
 
     def read(self):
-        self.value = grovepi.digitalRead(self.port)
+        self.setup()
+        self.value = self.bus.call("digitalRead", self.port)
         return self.value
 
 
 class Buzzer(GroveDevice):
-    def __init__(self, port=ports.D2):
-        GroveDevice.__init__(self, port)
-        grovepi.pinMode(port, ports.OUTPUT)
+    MODE = ports.OUTPUT
+
+    def __init__(self, port=ports.D2, bus=None):
+        GroveDevice.__init__(self, port, bus=bus)
+
+    def coerce(self, command):
+        return 1 if int(command) else 0
 
     def write(self, value):
-        self.value = value
-        grovepi.digitalWrite(self.port, value)
+        self.setup()
+        self.bus.call("digitalWrite", self.port, value)
+        GroveDevice.write(self, value)
 
 
 class Relay(GroveDevice):
-    def __init__(self, port=ports.D6):
-        GroveDevice.__init__(self, port)
-        grovepi.pinMode(port, ports.OUTPUT)
+    MODE = ports.OUTPUT
+
+    def __init__(self, port=ports.D6, bus=None):
+        GroveDevice.__init__(self, port, bus=bus)
+
+    def coerce(self, command):
+        return 1 if int(command) else 0
 
     def write(self, value):
-        self.value = value
-        grovepi.digitalWrite(self.port, value)
+        self.setup()
+        self.bus.call("digitalWrite", self.port, value)
+        GroveDevice.write(self, value)
 
 
 class UltrasonicRanger(GroveDevice):
-    def __init__(self, port=ports.D4):
-        GroveDevice.__init__(self, port)
+    def __init__(self, port=ports.D4, window=5, minimum=2, maximum=400,
+                 max_deviation=50, persistence=3, bus=None):
+        """ Readings are filtered by a filters.MedianFilter, so spikes and
+        timeouts are dropped rather than reported
+        :param window: The number of readings the median is taken over
+        :param minimum: The closest plausible range in cm
+        :param maximum: The furthest plausible range in cm
+        :param max_deviation: The furthest in cm a reading may be from the
+        median before it is an outlier
+        :param persistence: Outliers in a row after which they are accepted
+        """
+        GroveDevice.__init__(self, port, bus=bus)
+        self.filter = filters.MedianFilter(window, minimum, maximum,
+                                           max_deviation, persistence)
 
-        def read(self):
-            self.value = grovepi.ultrasonicRead(self.port)
-            return self.value
\ No newline at end of file
+    def read(self):
+        """ Reads the ranger
+        :return: The filtered range in cm, or None if the reading was
+        rejected
+        """
+        value = self.filter.process(self.bus.call("ultrasonicRead",
+                                                  self.port))
+        if value is not None:
+            self.value = value
+        return value
\ No newline at end of file
@@ -3,181 +3,101 @@ Implements a generalized IoT Device architecture and main loop. This IoT device
 receives actuator control messages over MQTT and publishes changing sensor and
 actuator data over MQTT. The default configuration utilizes all Grove Pi
 interfaces and demonstrates all sensor and actuator types provided in the
-starter kit.
+starter kit. The sensors and actuators are wired up from topology.json.
+
+The device itself is a device.Device, run here on its own gateway.Gateway. A
+gateway process can host many of them on one MQTT connection.
 """
 
 import GroveDevices
-import ports
-import paho.mqtt.client as mqtt
-import time
-import json
+import os
 import uuidgen
-import Queue
-import grove_rgb_lcd
+import device
+import gateway
+import outbox
+import topology
 
 debug = False
 
 DEVICE_UUID = uuidgen.generateUuid()
-SENSOR_DATA_TOPIC = "SNHU/IT697/sensor/data/"+DEVICE_UUID
-ACTUATOR_TOPIC = "SNHU/IT697/actuator/control/"+DEVICE_UUID
-
-# Actuators
-BUZZER = GroveDevices.Buzzer(ports.D2)
-BLUE_LED = GroveDevices.LED(ports.D5)
-RELAY = GroveDevices.Relay(ports.D6)
-RED_LED = GroveDevices.LED(ports.D8)
-LCD = GroveDevices.LCD() # I2C-1 port
-
-ACTUATORS = {
-    "blue_led": BLUE_LED,
-    "red_led": RED_LED,
-    "lcd": LCD,
-    "buzzer": BUZZER,
-    "relay": RELAY
-}
-
-# Sensors
-SOUND_SENSOR = GroveDevices.SoundSensor(ports.A0)
-LIGHT_SENSOR = GroveDevices.LightSensor(ports.A1)
-POTENTIOMETER = GroveDevices.Potentiometer(ports.A2)
-BUTTON = GroveDevices.Button(ports.D3)
-ULTRASONIC_RANGER = GroveDevices.UltrasonicRanger(ports.D4)
-DHT_SENSOR = GroveDevices.DHTSensor(ports.D7)
-
-SENSORS = [
-    ("potentiometer", POTENTIOMETER, 1),
-    ("light_sensor", LIGHT_SENSOR, 5),
-    ("sound_sensor", SOUND_SENSOR, 5),
-    ("button", BUTTON, 1),
-    ("ultrasonic_ranger", ULTRASONIC_RANGER, 5),
-    ("dht_sensor", DHT_SENSOR, 100)
-]
-
-
-def on_connect(client, userdata, flags, rc):
-    """Called each time the client connects to the message broker
-    :param client: The client object making the connection
-    :param userdata: Arbitrary context specified by the user program
-    :param flags: Response flags sent by the message broker
-    :param rc: the connection result
-    :return: None
-    """
-    # subscribe to the ACTUATOR topic when connected
-    client.subscribe(ACTUATOR_TOPIC)
 
-# A message queue is required to coordinate reads and writes from/to
-# the GrovePi
-MSG_QUEUE = Queue.Queue()
+# Changed values are merged for PUBLISH_WINDOW seconds before being sent, but
+# never held for longer than PUBLISH_MAX_LATENCY seconds.
+PUBLISH_WINDOW = 0.2
+PUBLISH_MAX_LATENCY = 1.0
 
 
-def on_message(client, userdata, msg):
-    """Called for each message received
-    :param client: The client object making the connection
-    :param userdata: Arbitrary context specified by the user program
-    :param msg: The message from the MQTT broker
-    :return: None
-    """
-    MSG_QUEUE.put(msg.payload)
+# The sensors and actuators of the device, see topology.py
+TOPOLOGY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "topology.json")
 
 
-def calculate_delta(sensor_name, value, last_values, changed_values):
-    """Determine which values have changed from their last values
-    :param sensor_name: The sensor name the value was read from
-    :param value: The new value
-    :param last_values: The last set of checked values
-    :param changed_values: The set of values that have changed
+def build_device(device_uuid, device_outbox, bus=None, config=None):
+    """ Creates the device described by a topology config, by default the
+    starter kit: every sensor and actuator type on the Grove Pi ports the
+    kit's examples use
+    :param device_uuid: The UUID the device's topics end in
+    :param device_outbox: The outbox.Outbox the device publishes through
+    :param bus: The grovebus.BusManager of the device's board,
+    GroveDevices.BUS if None
+    :param config: The topology config dict, read from TOPOLOGY_PATH if None
+    :return: The device.Device
     """
-    try:
-        if last_values[sensor_name] == value:
-            return
-    except KeyError:
-        pass
-    changed_values[sensor_name] = value
-    last_values[sensor_name] = value
+    bus = bus or GroveDevices.BUS
+    if config is None:
+        config = topology.load(TOPOLOGY_PATH)
+    sensors, actuators, aggregators, derivations = topology.build(config, bus)
+    return device.Device(device_uuid, sensors, actuators, device_outbox, bus,
+                         PUBLISH_WINDOW, PUBLISH_MAX_LATENCY, aggregators,
+                         derivations)
 
 
-read_count = 0
-last_values = {}
+# Sensor data is stored on disk until the broker acknowledges it
+OUTBOX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "outbox.dat")
+OUTBOX_SIZE = 1024 * 1024
+OUTBOX_REPLAY_RATE = 20
 
+MESSAGE_BROKER_URI = "localhost"
 
-def read_sensors_and_actuators():
-    """ Reads sensors and actuators and returns the values that have changed
-    since last read
-    :return: The changed values since last read
-    """
-    global read_count
-    changed_values = {}
-    for sensor_name, sensor, priority in SENSORS:
-        if not (read_count % priority):
-            calculate_delta(sensor_name, sensor.read(), last_values,
-                            changed_values)
-    read_count += 1
-    for actuator_name, actuator in ACTUATORS.iteritems():
-        calculate_delta(actuator_name, actuator.read(), last_values,
-                        changed_values)
-    return changed_values
-
-
-def publish_sensor_data(values):
-    """ Publishes data over MQTT to the sensor data topic
-    :param values: The sensor values to send
-    :return: None
-    """
-    values["timestamp"] = int(time.time()*1000)
-    out_str = json.dumps(values)
-    mqtt_client.publish(SENSOR_DATA_TOPIC, out_str)
-    print("==>> " + out_str)
+# Metrics are published every METRICS_INTERVAL seconds and served for
+# Prometheus at http://<device>:9105/metrics, see metrics.py
+METRICS_INTERVAL = 10.0
+METRICS_ADDRESS = ("", 9105)
 
 
-def process_received_messages():
-    """ Processes all MQTT messages placed in the message queue.
+def main(client=None):
+    """ Connects to the message broker and runs the device main loop until
+    interrupted.
+    :param client: The MQTT client to use, a new one if None
     :return: None
     """
-    while True:
-        try:
-            payload = MSG_QUEUE.get(False)
-            print("<<== " + payload)
-            payload = json.loads(payload)
-            for actuator, msg in payload.iteritems():
-                try:
-                    ACTUATORS[actuator].write(msg)
-                except KeyError:
-                    pass
-        except Queue.Empty:
-            break
-
-
-MESSAGE_BROKER_URI = "localhost"
-mqtt_client = mqtt.Client()
-mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
-mqtt_client.connect(MESSAGE_BROKER_URI)
-mqtt_client.loop_start()
-
-time.sleep(1)  # give the hardware time to initialize
-
-try:
-    while True:
-        try:
-            changedValues = read_sensors_and_actuators()
-
-            if changedValues:
-                publish_sensor_data(changedValues)
-
-            process_received_messages()
-
-        except (IOError, TypeError) as e:
-            print("Error", e)
-
-except KeyboardInterrupt as e:
-    if debug:
-        print type(e)
-
-finally:
-    print "Turning display off"
-    grove_rgb_lcd.setText('')
-    grove_rgb_lcd.setRGB(0, 0, 0)
-    #print "Turning LEDs off"
-    #grovepi.analogWrite(RED_LED,0)
-    #grovepi.analogWrite(GREEN_LED,0)
-    #grovepi.analogWrite(BLUE_LED,0)
\ No newline at end of file
+    device_outbox = outbox.Outbox(OUTBOX_PATH, OUTBOX_SIZE, OUTBOX_REPLAY_RATE)
+    gw = gateway.Gateway(MESSAGE_BROKER_URI, device_outbox, client,
+                         METRICS_INTERVAL, METRICS_ADDRESS)
+    starter_kit = build_device(DEVICE_UUID, device_outbox)
+    gw.add(starter_kit)
+    try:
+        gw.run()
+    finally:
+        if debug:
+            stats = starter_kit.stats()
+            for sensor_name, sensor_stats in stats["sensors"].iteritems():
+                print sensor_name, sensor_stats
+            print "actuator latency", stats["actuator_latency"]
+            print "actuator commands", stats["commands"]
+            print "outbox", device_outbox.stats()
+            for key, bus_stats in sorted(stats["bus"].iteritems()):
+                print key, bus_stats
+        print "Turning display off"
+        lcd = starter_kit.actuators["lcd"]
+        lcd.write({"text": "", "rgb": (0, 0, 0)})
+        lcd.flush()
+        #print "Turning LEDs off"
+        #grovepi.analogWrite(RED_LED,0)
+        #grovepi.analogWrite(GREEN_LED,0)
+        #grovepi.analogWrite(BLUE_LED,0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Summarizes high-rate sensors over tumbling windows. Each window's count, min,
+max, mean and standard deviation are computed as samples arrive, with
+Welford's algorithm, so a sensor costs the same few numbers of memory however
+fast it is read. Windows are aligned to multiples of their length in wall
+clock time, so summaries from different devices line up. A summary is
+published once its window has ended, in place of or alongside the raw values.
+"""
+
+import math
+import numbers
+import time
+
+
+class Welford(object):
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def stddev(self):
+        """ Returns the population standard deviation """
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+
+class WindowAggregator(object):
+    __slots__ = ("window", "raw", "clock", "stats", "window_start")
+
+    def __init__(self, window=10.0, raw=False, clock=time.time):
+        """
+        :param window: The length of each window in seconds
+        :param raw: Whether raw values are published alongside the summaries
+        """
+        if window <= 0:
+            raise ValueError("window must be positive")
+        self.window = float(window)
+        self.raw = raw
+        self.clock = clock
+        self.stats = Welford()
+        self.window_start = None
+
+    def add(self, value, t=None):
+        """ Adds a sample to the current window. Samples that are not numbers
+        are ignored.
+        :param value: The sample
+        :param t: The time of the sample in seconds, now if None
+        :return: The summary of the window the sample closed, or None
+        """
+        if isinstance(value, bool) or not isinstance(value, numbers.Number):
+            return None
+        if t is None:
+            t = self.clock()
+        summary = None
+        if self.window_start is not None and \
+                t >= self.window_start + self.window:
+            summary = self.close()
+        if self.window_start is None:
+            self.window_start = t - t % self.window
+        self.stats.add(value)
+        return summary
+
+    def time_until_close(self):
+        """ Returns the number of seconds until the current window ends
+        :return: Seconds until the window's summary is due, or None if the
+        window is empty
+        """
+        if self.window_start is None:
+            return None
+        return max(0.0, self.window_start + self.window - self.clock())
+
+    def poll(self):
+        """ Closes the current window if it has ended
+        :return: The window's summary, or None
+        """
+        if self.time_until_close() == 0.0:
+            return self.close()
+        return None
+
+    def close(self):
+        """ Ends the current window
+        :return: A dict of the window's start time in ms, sample count, min,
+        max, mean and standard deviation
+        """
+        stats = self.stats
+        summary = {
+            "start": int(self.window_start * 1000),
+            "window": self.window,
+            "count": stats.count,
+            "min": stats.min,
+            "max": stats.max,
+            "mean": round(stats.mean, 3),
+            "stddev": round(stats.stddev(), 3)
+        }
+        stats.reset()
+        self.window_start = None
+        return summary
@@ -0,0 +1,268 @@
+"""
+Benchmarks the IoTDevice sensor read, delta, publish and actuator command paths
+against the simulated Grove Pi bus and an in-process stand-in for the MQTT
+client, so no board or broker is needed. Reports loops per second, p50/p99
+latency for each stage, with the bursts of burst sensors timed as a stage of
+their own, and the allocations still held per iteration: memory
+blocks and peak traced memory where tracemalloc is available (Python 3), and
+otherwise the growth in objects tracked by the garbage collector.
+
+    python benchmark.py [--iterations N] [--latency S] [--burst N] [--json]
+"""
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import device as device_module
+import grovesim
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class LoopbackMessage(object):
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class LoopbackClient(object):
+    """ An in-process stand-in for paho's mqtt.Client that counts what is
+    published and delivers injected messages to on_message
+    """
+    def __init__(self):
+        self.on_connect = None
+        self.on_message = None
+        self.subscriptions = set()
+        self.on_publish = None
+        self.messages = 0
+        self.bytes = 0
+
+    def subscribe(self, topic, qos=0):
+        # Like paho, accepts a list of (topic, qos) tuples
+        if isinstance(topic, list):
+            self.subscriptions.update(name for name, _ in topic)
+        else:
+            self.subscriptions.add(topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """ Publishes and, like a broker, acknowledges the message at once """
+        self.messages += 1
+        self.bytes += len(payload or "")
+        if self.on_publish:
+            self.on_publish(self, None, self.messages)
+        return 0, self.messages
+
+    def deliver(self, topic, payload):
+        self.on_message(self, None, LoopbackMessage(topic, payload))
+
+
+class StepClock(object):
+    """ A clock that advances one step per tick so that every scheduled
+    sensor is due on every benchmark iteration
+    """
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        return self.now
+
+    def tick(self):
+        self.now += self.step
+
+
+class NullWriter(object):
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Stage(object):
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+
+    def time(self, fn, *args):
+        start = time.time()
+        result = fn(*args)
+        self.samples.append(time.time() - start)
+        return result
+
+    def report(self):
+        return {
+            "calls": len(self.samples),
+            "p50_us": round(percentile(self.samples, 0.50) * 1e6, 1),
+            "p99_us": round(percentile(self.samples, 0.99) * 1e6, 1)
+        }
+
+
+def run(iterations, latency, burst=1):
+    """ Runs the device pipeline for a number of iterations
+    :param iterations: The number of loop iterations to run
+    :param latency: Simulated seconds per bus call
+    :param burst: Actuator commands delivered per iteration
+    :return: A dict of results
+    """
+    grovesim.install(grovesim.default_bus(latency=latency, seed=0))
+    import GroveDevices
+    import IoTDevice
+    import gateway
+    import outbox
+    import scheduler
+
+    client = LoopbackClient()
+    outbox_dir = tempfile.mkdtemp()
+    device_outbox = outbox.Outbox(os.path.join(outbox_dir, "outbox.dat"),
+                                  rate=1e9, burst=1000)
+    # The gateway routes the loopback client's messages to the device
+    gw = gateway.Gateway(None, device_outbox, client)
+    device = IoTDevice.build_device("benchmark", device_outbox)
+    gw.add(device)
+    gw.on_connect(client, None, None, 0)
+
+    slowest = max(1.0 / rate for _, _, rate, _ in device.sensors)
+    clock = StepClock(slowest)
+    device.scheduler = scheduler.Scheduler(clock=clock)
+    for sensor_name, sensor, rate, _ in device.sensors:
+        device.scheduler.add(sensor_name, sensor.sample, hz=rate)
+    # A device takes bursts on a worker thread. Since every sensor is due on
+    # every iteration, that thread would never stop contending for the bus,
+    # so bursts are taken here between iterations instead and timed alone.
+    bursts = [sensor for _, sensor, _, _ in device.sensors
+              if isinstance(sensor, GroveDevices.BurstSensor)]
+    for sensor in bursts:
+        sensor.read = lambda sensor=sensor: sensor.value
+
+    stages = dict((name, Stage(name)) for name in
+                  ("take_burst", "read_sensors_and_actuators",
+                   "calculate_delta", "publish_sensor_data", "drain_outbox",
+                   "process_received_messages"))
+    commands = [json.dumps({"blue_led": i % 256, "lcd": {"text": str(i)}})
+                for i in range(burst)]
+    # calculate_delta is timed where the device calls it, within
+    # read_sensors_and_actuators
+    real_delta = device_module.calculate_delta
+
+    def timed_delta(*args):
+        return stages["calculate_delta"].time(real_delta, *args)
+
+    device_module.calculate_delta = timed_delta
+
+    stdout = sys.stdout
+    sys.stdout = NullWriter()
+    if tracemalloc:
+        tracemalloc.start()
+        baseline = tracemalloc.take_snapshot()
+    else:
+        gc.collect()
+        baseline = len(gc.get_objects())
+    start = time.time()
+    try:
+        for _ in range(iterations):
+            for sensor in bursts:
+                stages["take_burst"].time(sensor.take_burst)
+            changed = stages["read_sensors_and_actuators"].time(
+                device.read_sensors_and_actuators)
+            if changed:
+                stages["publish_sensor_data"].time(
+                    device.publish_sensor_data, changed)
+            stages["drain_outbox"].time(device_outbox.drain, client)
+            for command in commands:
+                client.deliver(device.actuator_topic, command)
+            stages["process_received_messages"].time(
+                device.process_received_messages)
+            clock.tick()
+    finally:
+        elapsed = time.time() - start
+        sys.stdout = stdout
+        device_module.calculate_delta = real_delta
+        device_outbox.close()
+        shutil.rmtree(outbox_dir)
+
+    # The loop rate is that of the device's loop, which bursts do not hold up
+    elapsed -= sum(stages["take_burst"].samples)
+    results = {
+        "iterations": iterations,
+        "loops_per_sec": round(iterations / elapsed, 1),
+        "publishes": client.messages,
+        "published_bytes": client.bytes,
+        "allocations_per_iteration": None,
+        "allocation_measure": None,
+        "stages": dict((name, stage.report())
+                       for name, stage in stages.items() if stage.samples),
+        "bus": device.bus.stats(),
+        "commands": device.commands.stats()
+    }
+    if tracemalloc:
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        blocks = sum(stat.count_diff for stat in
+                     snapshot.compare_to(baseline, "filename"))
+        results["allocations_per_iteration"] = round(
+            float(blocks) / iterations, 2)
+        results["allocation_measure"] = "blocks"
+        results["peak_traced_bytes"] = peak
+    else:
+        gc.collect()
+        objects = len(gc.get_objects()) - baseline
+        results["allocations_per_iteration"] = round(
+            float(objects) / iterations, 2)
+        results["allocation_measure"] = "gc objects"
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the IoTDevice pipeline on a simulated bus")
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated seconds per bus call")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="actuator commands delivered per iteration")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.latency, args.burst)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print("%d iterations, %.1f loops/sec, %d publishes, %d bytes" % (
+        results["iterations"], results["loops_per_sec"],
+        results["publishes"], results["published_bytes"]))
+    if results["allocations_per_iteration"] is not None:
+        print("%.2f %s allocated and held/iteration" % (
+            results["allocations_per_iteration"],
+            results["allocation_measure"]))
+    print("%-28s %8s %10s %10s" % ("stage", "calls", "p50 us", "p99 us"))
+    for name in sorted(results["stages"]):
+        stage = results["stages"][name]
+        print("%-28s %8d %10.1f %10.1f" % (name, stage["calls"],
+                                           stage["p50_us"], stage["p99_us"]))
+    commands = results["commands"]
+    print("%d commands received, %d superseded, %d dropped" % (
+        commands["received"], commands["superseded"], commands["dropped"]))
+    sweep = results["bus"]["sweep"]
+    print("%d bus sweeps, mean %.3f ms, max %.3f ms" % (
+        sweep["count"], sweep["mean_ms"], sweep["max_ms"]))
+
+
+if __name__ == "__main__":
+    main()
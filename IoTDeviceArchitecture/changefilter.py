@@ -0,0 +1,72 @@
+"""
+Decides whether a new sensor reading is different enough from the last reported
+value to be published. A ChangeFilter is declared alongside each sensor with an
+absolute and a relative deadband, hysteresis against reversing direction, and a
+minimum interval between reported changes. Sensors that return a dict, such as
+the DHT sensor, are compared field by field and change if any field does.
+"""
+
+import numbers
+import time
+
+
+class ChangeFilter(object):
+    def __init__(self, absolute=0, relative=0.0, hysteresis=0,
+                 min_interval=0.0, clock=time.time):
+        """
+        :param absolute: A change must be larger than this to be reported
+        :param relative: A change must be larger than this fraction of the
+        last reported value to be reported
+        :param hysteresis: Extra change needed to report a move back in the
+        opposite direction to the last reported change
+        :param min_interval: Fewest seconds between reported changes
+        """
+        self.absolute = absolute
+        self.relative = relative
+        self.hysteresis = hysteresis
+        self.min_interval = min_interval
+        self.clock = clock
+        self.directions = {}
+        self.last_reported = None
+
+    def _moved(self, key, last, value):
+        """ Returns the direction a field moved in, 0 if it did not move far
+        enough to be reported, or None if a non-numeric field changed
+        """
+        if (isinstance(value, bool) or isinstance(last, bool) or
+                not isinstance(value, numbers.Number) or
+                not isinstance(last, numbers.Number)):
+            return 0 if last == value else None
+        delta = value - last
+        if not delta:
+            return 0
+        direction = 1 if delta > 0 else -1
+        band = max(self.absolute, self.relative * abs(last))
+        if self.directions.get(key, direction) != direction:
+            band += self.hysteresis
+        return direction if abs(delta) > band else 0
+
+    def is_change(self, last, value):
+        """ Determines whether value should be reported as a change from last
+        :param last: The last reported value
+        :param value: The new value
+        :return: True if the change should be reported
+        """
+        now = self.clock()
+        if (self.min_interval and self.last_reported is not None and
+                now - self.last_reported < self.min_interval):
+            return False
+        if isinstance(value, dict) and isinstance(last, dict):
+            moves = dict((key, self._moved(key, last.get(key), field))
+                         for key, field in value.items())
+            if set(last) - set(value):
+                moves[None] = None
+        else:
+            moves = {None: self._moved(None, last, value)}
+        if all(direction == 0 for direction in moves.values()):
+            return False
+        for key, direction in moves.items():
+            if direction:
+                self.directions[key] = direction
+        self.last_reported = now
+        return True
@@ -0,0 +1,64 @@
+"""
+Coalesces changed sensor values into fewer, larger messages. Values added within
+a window are merged, newest value per name winning, and sent as one message once
+no new change has arrived for the length of the window. A maximum latency bounds
+how long a value can be held back by a steady stream of changes.
+"""
+
+import time
+
+
+class PublishCoalescer(object):
+    def __init__(self, publish, window=0.2, max_latency=1.0, clock=time.time):
+        """
+        :param publish: Called with the merged dict of values to send
+        :param window: Seconds without a new change before values are sent
+        :param max_latency: Most seconds any value is held before it is sent
+        """
+        self.publish = publish
+        self.window = window
+        self.max_latency = max(window, max_latency)
+        self.clock = clock
+        self.pending = {}
+        self.first_change = None
+        self.last_change = None
+
+    def add(self, values):
+        """ Merges changed values into the pending message
+        :param values: A dict of changed values
+        :return: None
+        """
+        if not values:
+            return
+        now = self.clock()
+        if not self.pending:
+            self.first_change = now
+        self.last_change = now
+        self.pending.update(values)
+
+    def time_until_flush(self):
+        """ Returns the number of seconds until the pending values are due
+        :return: Seconds until the next flush, or None if nothing is pending
+        """
+        if not self.pending:
+            return None
+        due = min(self.last_change + self.window,
+                  self.first_change + self.max_latency)
+        return max(0.0, due - self.clock())
+
+    def poll(self):
+        """ Sends the pending values if they are due
+        :return: True if a message was sent
+        """
+        if self.pending and self.time_until_flush() == 0.0:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """ Sends any pending values immediately
+        :return: None
+        """
+        if self.pending:
+            values, self.pending = self.pending, {}
+            self.publish(values)
@@ -0,0 +1,106 @@
+"""
+A last-write-wins queue for actuator commands. Each received message is split
+into one command per actuator, and a command replaces any command still
+pending for the same actuator, so a burst of slider updates is applied as its
+final value rather than replayed step by step. Dict commands, such as the
+LCD's, are merged so that a pending "rgb" is not lost to a later "text". The
+queue holds at most one command per known actuator, which bounds its memory
+and the time taken to drain it. Commands are checked as they are queued, on
+the network thread, so the actuator thread only ever sees valid ones. Drop and
+supersede counts are kept for monitoring.
+"""
+
+import json
+import threading
+import time
+
+
+class CommandQueue(object):
+    def __init__(self, actuators, max_payload=4096):
+        """
+        :param actuators: A dict of the names of the actuators commands may
+        address to a function checking and converting their commands, see
+        GroveDevices.GroveDevice.coerce, or a sequence of names to accept any
+        command
+        :param max_payload: Messages larger than this many bytes are dropped
+        """
+        if not isinstance(actuators, dict):
+            actuators = dict((name, None) for name in actuators)
+        self.actuators = actuators
+        self.max_payload = max_payload
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.received = 0
+        self.superseded = 0
+        self.dropped = 0
+
+    def put(self, payload, received=None):
+        """ Queues the commands in a message, replacing older pending ones
+        :param payload: The JSON message mapping actuator names to commands
+        :param received: When the message was received, now if None
+        :return: None
+        """
+        if received is None:
+            received = time.time()
+        with self.condition:
+            self.received += 1
+            if len(payload) > self.max_payload:
+                self.dropped += 1
+                return
+            try:
+                commands = json.loads(payload)
+                items = commands.items()
+            except (ValueError, AttributeError):
+                self.dropped += 1
+                return
+            for actuator, command in items:
+                if actuator not in self.actuators:
+                    self.dropped += 1
+                    continue
+                coerce = self.actuators[actuator]
+                if coerce is not None:
+                    try:
+                        command = coerce(command)
+                    except (TypeError, ValueError):
+                        self.dropped += 1
+                        continue
+                previous = self.pending.get(actuator)
+                if previous is None:
+                    self.pending[actuator] = (received, command)
+                    continue
+                first_received, pending = previous
+                self.superseded += 1
+                if isinstance(pending, dict) and isinstance(command, dict):
+                    merged = dict(pending)
+                    merged.update(command)
+                    command = merged
+                # Keep the time the oldest command arrived so that latency
+                # covers the whole time the actuator waited.
+                self.pending[actuator] = (first_received, command)
+            if self.pending:
+                self.condition.notify()
+
+    def get(self, timeout=None):
+        """ Takes every pending command
+        :param timeout: Seconds to wait for a command, or None to return
+        immediately
+        :return: A dict of actuator name to (received, command), empty if
+        there were none
+        """
+        with self.condition:
+            if not self.pending and timeout:
+                self.condition.wait(timeout)
+            commands, self.pending = self.pending, {}
+            return commands
+
+    def qsize(self):
+        """ Returns the number of actuators with a pending command """
+        return len(self.pending)
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "superseded": self.superseded,
+            "dropped": self.dropped,
+            "pending": len(self.pending)
+        }
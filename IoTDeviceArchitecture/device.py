@@ -0,0 +1,314 @@
+"""
+An IoT device: a set of named sensors and actuators on one Grove Pi, with the
+scheduling, change detection, coalescing, command queue and history that go
+with them. A device does not own an MQTT connection. It publishes through an
+outbox and is handed the messages addressed to it, so that a gateway process
+can host many devices on one connection. Each device's topics end in its UUID.
+
+Sensors with a window aggregator also publish a summary of each window under
+their name with STATS_SUFFIX appended, and may leave out their raw values.
+"""
+
+import json
+import threading
+import time
+
+import coalesce
+import commands
+import history
+import scheduler
+
+SENSOR_DATA_TOPIC = "SNHU/IT697/sensor/data/"
+ACTUATOR_TOPIC = "SNHU/IT697/actuator/control/"
+HISTORY_REQUEST_TOPIC = "SNHU/IT697/history/request/"
+HISTORY_RESPONSE_TOPIC = "SNHU/IT697/history/response/"
+
+# How often the dispatcher checks whether it should stop
+DISPATCH_POLL = 0.5
+STATS_SUFFIX = "_stats"
+
+
+def calculate_delta(sensor_name, value, last_values, changed_values,
+                    change_filter=None):
+    """Determine which values have changed from their last values
+    :param sensor_name: The sensor name the value was read from
+    :param value: The new value
+    :param last_values: The last set of checked values
+    :param changed_values: The set of values that have changed
+    :param change_filter: The ChangeFilter deciding whether the value has
+    changed enough, or None to report any change
+    """
+    try:
+        last_value = last_values[sensor_name]
+    except KeyError:
+        pass
+    else:
+        if change_filter is None:
+            if last_value == value:
+                return
+        elif not change_filter.is_change(last_value, value):
+            return
+    changed_values[sensor_name] = value
+    last_values[sensor_name] = value
+
+
+class Device(object):
+    def __init__(self, device_uuid, sensors, actuators, outbox, bus,
+                 publish_window=0.2, publish_max_latency=1.0,
+                 aggregators=None, derivations=None, clock=time.time):
+        """
+        :param device_uuid: The UUID the device's topics end in
+        :param sensors: A list of (name, sensor, rate in Hz, change filter)
+        tuples. Sensors without a change filter report every change in value.
+        :param actuators: A dict of actuator name to GroveDevice
+        :param outbox: The outbox.Outbox sensor data is published through
+        :param bus: The grovebus.BusManager the sensors are attached to
+        :param publish_window: Seconds changed values are merged for before
+        being sent
+        :param publish_max_latency: Most seconds a changed value is held
+        :param aggregators: A dict of sensor name to
+        aggregate.WindowAggregator for the sensors that publish summaries
+        :param derivations: A dict of sensor name to derived.Derive for the
+        sensors whose published readings have derived fields added
+        """
+        self.uuid = device_uuid
+        self.sensor_data_topic = SENSOR_DATA_TOPIC + device_uuid
+        self.actuator_topic = ACTUATOR_TOPIC + device_uuid
+        self.history_request_topic = HISTORY_REQUEST_TOPIC + device_uuid
+        self.history_response_topic = HISTORY_RESPONSE_TOPIC + device_uuid
+        self.sensors = sensors
+        self.actuators = actuators
+        self.outbox = outbox
+        self.bus = bus
+        self.clock = clock
+        self.aggregators = aggregators or {}
+        self.derivations = derivations or {}
+        self.change_filters = dict((sensor_name, change_filter)
+                                   for sensor_name, _, _, change_filter
+                                   in sensors)
+        self.scheduler = scheduler.Scheduler(clock=clock)
+        for sensor_name, sensor, rate, _ in sensors:
+            self.scheduler.add(sensor_name, sensor.sample, hz=rate)
+        # Hands actuator commands from the MQTT network thread to the
+        # actuator dispatcher thread, keeping only the newest per actuator.
+        # Commands are checked as they are queued, so the dispatch table only
+        # ever sees known actuators and valid commands.
+        self.commands = commands.CommandQueue(dict(
+            (name, actuator.coerce) for name, actuator in actuators.items()))
+        self.dispatch = dict((name, actuator.write)
+                             for name, actuator in actuators.items())
+        # Recent readings of every sensor, kept on the device
+        self.history = history.HistoryStore(clock=clock)
+        self.coalescer = coalesce.PublishCoalescer(
+            self.publish_sensor_data, publish_window, publish_max_latency,
+            clock)
+        # Actuators such as the LCD that hold back updates to rate limit them
+        self.refreshable = [actuator for actuator in actuators.values()
+                            if hasattr(actuator, "refresh")]
+        self.last_values = {}
+        # The version of each actuator last reported, see GroveDevice.version
+        self.actuator_versions = {}
+        # Seconds from a command being received to it being applied
+        self.actuator_latency = {"last": 0.0, "max": 0.0}
+        self.published = 0
+        self.published_bytes = 0
+        self.stopping = threading.Event()
+        self.dispatcher = None
+
+    def subscriptions(self):
+        """ Returns the topics the device receives messages on """
+        return [self.actuator_topic, self.history_request_topic]
+
+    def on_message(self, client, msg):
+        """ Handles a message received on one of the device's topics
+        :param client: The client the message arrived on
+        :param msg: The message from the MQTT broker
+        :return: None
+        """
+        if msg.topic == self.history_request_topic:
+            self.answer_history_request(client, msg.payload)
+        else:
+            self.commands.put(msg.payload)
+
+    def answer_history_request(self, client, payload):
+        """ Publishes the history asked for by a request. Requests only read
+        the history store, so they are answered on the network thread.
+        :param client: The client the request arrived on
+        :param payload: The JSON request, see history.HistoryStore.handle_request
+        :return: None
+        """
+        try:
+            request = json.loads(payload)
+            response = self.history.handle_request(request)
+        except (ValueError, AttributeError):
+            response = {"error": "malformed request"}
+        client.publish(self.history_response_topic, json.dumps(response))
+
+    def read_sensors_and_actuators(self):
+        """ Reads the sensors that are due and returns their values that have
+        changed since last read, along with any actuators written since
+        :return: The changed values since last read
+        """
+        changed_values = {}
+        # Sensors that are due together are read back to back in one sweep
+        due = [(task.name, task.callback)
+               for task in self.scheduler.pop_due()]
+        now = self.clock()
+        for sensor_name, value in self.bus.sweep(due):
+            # A sensor with no usable reading returns None
+            if value is not None:
+                self.history.record(sensor_name, value, now)
+                aggregator = self.aggregators.get(sensor_name)
+                if aggregator is not None:
+                    summary = aggregator.add(value, now)
+                    if summary is not None:
+                        changed_values[sensor_name + STATS_SUFFIX] = summary
+                    if not aggregator.raw:
+                        continue
+                calculate_delta(sensor_name, value, self.last_values,
+                                changed_values,
+                                self.change_filters[sensor_name])
+        for actuator_name, actuator in self.actuators.iteritems():
+            # Read the version before the value so a concurrent write is never
+            # missed, only reported twice.
+            version = actuator.version
+            if self.actuator_versions.get(actuator_name) != version:
+                self.actuator_versions[actuator_name] = version
+                changed_values[actuator_name] = actuator.value
+        return changed_values
+
+    def publish_sensor_data(self, values):
+        """ Publishes data over MQTT to the sensor data topic, by way of the
+        outbox
+        :param values: The sensor values to send
+        :return: None
+        """
+        # Derived fields are added only now, after change detection, so they
+        # do not count towards whether a reading changed.
+        for sensor_name, derive in self.derivations.items():
+            if sensor_name in values:
+                values[sensor_name] = derive.process(values[sensor_name])
+        values["timestamp"] = int(time.time()*1000)
+        out_str = json.dumps(values)
+        self.outbox.append(self.sensor_data_topic, out_str)
+        self.published += 1
+        self.published_bytes += len(out_str)
+        print("==>> " + out_str)
+
+    def step(self):
+        """ Reads the sensors that are due and sends any coalesced values
+        that are due
+        :return: None
+        """
+        self.coalescer.add(self.read_sensors_and_actuators())
+        self.coalescer.add(self.poll_aggregators())
+        self.coalescer.poll()
+
+    def poll_aggregators(self, close=False):
+        """ Collects the summaries of windows that have ended
+        :param close: Whether to end every window now, e.g. when stopping
+        :return: A dict of the summaries to publish
+        """
+        summaries = {}
+        for sensor_name, aggregator in self.aggregators.items():
+            if close:
+                if aggregator.time_until_close() is None:
+                    continue
+                summary = aggregator.close()
+            else:
+                summary = aggregator.poll()
+            if summary is not None:
+                summaries[sensor_name + STATS_SUFFIX] = summary
+        return summaries
+
+    def next_wakeup(self):
+        """ Returns how long the device may wait before it has work to do
+        :return: Seconds until the next sensor read, window summary or
+        coalesced publish is due, or None if none is
+        """
+        delays = [delay for delay in
+                  [self.scheduler.time_until_next(),
+                   self.coalescer.time_until_flush()] +
+                  [aggregator.time_until_close()
+                   for aggregator in self.aggregators.values()]
+                  if delay is not None]
+        return min(delays) if delays else None
+
+    def process_received_messages(self, timeout=None):
+        """ Applies the pending actuator commands, the newest for each
+        actuator.
+        :param timeout: Seconds to wait for a command, or None to return
+        immediately when there are none
+        :return: None
+        """
+        pending = self.commands.get(timeout)
+        if not pending:
+            return
+        print("<<== " + json.dumps(dict((actuator, command) for actuator,
+                                        (_, command) in pending.iteritems())))
+        for actuator, (received, command) in pending.iteritems():
+            # A bus error on one actuator must not stop the others
+            try:
+                self.dispatch[actuator](command)
+            except IOError as e:
+                print("Error", actuator, e)
+            latency = time.time() - received
+            self.actuator_latency["last"] = latency
+            self.actuator_latency["max"] = max(self.actuator_latency["max"],
+                                               latency)
+
+    def _refresh_wait(self):
+        waits = [wait for wait in (actuator.time_until_refresh()
+                                   for actuator in self.refreshable)
+                 if wait is not None]
+        return min(waits + [DISPATCH_POLL])
+
+    def dispatch_actuator_commands(self):
+        """ Applies actuator commands as soon as they arrive. Runs on its own
+        thread so that a command waits for at most one bus transaction rather
+        than for a full pass over the sensors.
+        :return: None
+        """
+        while not self.stopping.is_set():
+            try:
+                # Wake in time to send updates held back by a rate limit
+                self.process_received_messages(self._refresh_wait())
+                for actuator in self.refreshable:
+                    actuator.refresh()
+            except (IOError, TypeError, ValueError, AttributeError) as e:
+                print("Error", e)
+
+    def start(self):
+        """ Starts the actuator dispatcher and the sensor schedule
+        :return: None
+        """
+        self.stopping.clear()
+        self.dispatcher = threading.Thread(
+            target=self.dispatch_actuator_commands,
+            name="actuator-dispatcher-" + self.uuid)
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+        self.scheduler.restart()
+
+    def stop(self):
+        """ Stops the actuator dispatcher and sends any coalesced values and
+        the summaries of the windows so far
+        :return: None
+        """
+        self.stopping.set()
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+            self.dispatcher = None
+        self.coalescer.add(self.poll_aggregators(close=True))
+        self.coalescer.flush()
+
+    def stats(self):
+        """ Returns the device's scheduling, command and bus statistics """
+        return {
+            "sensors": self.scheduler.stats(),
+            "actuator_latency": dict(self.actuator_latency),
+            "commands": self.commands.stats(),
+            "published": self.published,
+            "published_bytes": self.published_bytes,
+            "bus": self.bus.stats()
+        }
@@ -0,0 +1,71 @@
+"""
+Extracts features from a burst of samples taken from an analog port, so that a
+device can report what a signal such as sound is doing without publishing the
+samples themselves. The features are the RMS and peak of the signal about its
+mean, its zero-crossing rate and the energy in a few equal-width frequency
+bands from DC to the Nyquist frequency. NumPy is used when it is installed;
+without it the band energies are left out.
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def buffer(size):
+    """ Returns a preallocated sample buffer of a given size """
+    if numpy is not None:
+        return numpy.zeros(size)
+    import array
+    return array.array("d", [0.0]) * size
+
+
+def extract(samples, rate, bands=4):
+    """ Computes the features of a burst of samples
+    :param samples: The samples, see buffer
+    :param rate: The rate the samples were taken at in Hz
+    :param bands: The number of frequency bands to report the energy of
+    :return: A dict of "rms", "peak", "zcr" (zero crossings per second),
+    "rate" and, with NumPy, "bands" (a list of band energies) and "band_hz"
+    (the width of each band)
+    """
+    if numpy is None:
+        return _extract(samples, rate)
+    signal = samples - samples.mean()
+    crossings = numpy.count_nonzero(numpy.diff(numpy.signbit(signal)))
+    power = numpy.abs(numpy.fft.rfft(signal)) ** 2 / len(signal)
+    # The DC bin is empty once the mean is removed
+    energies = [float(band.sum())
+                for band in numpy.array_split(power[1:], bands)]
+    return {
+        "rms": round(float(numpy.sqrt(numpy.mean(signal * signal))), 3),
+        "peak": round(float(numpy.abs(signal).max()), 3),
+        "zcr": round(crossings * rate / len(signal), 3),
+        "rate": round(rate, 1),
+        "bands": [round(energy, 1) for energy in energies],
+        "band_hz": round(rate / 2.0 / bands, 1)
+    }
+
+
+def _extract(samples, rate):
+    mean = sum(samples) / len(samples)
+    total = 0.0
+    peak = 0.0
+    crossings = 0
+    below = None
+    for sample in samples:
+        value = sample - mean
+        total += value * value
+        peak = max(peak, abs(value))
+        if below is not None and (value < 0) != below:
+            crossings += 1
+        below = value < 0
+    return {
+        "rms": round(math.sqrt(total / len(samples)), 3),
+        "peak": round(peak, 3),
+        "zcr": round(crossings * rate / len(samples), 3),
+        "rate": round(rate, 1)
+    }
@@ -0,0 +1,222 @@
+"""
+Hosts many devices in one process on a single MQTT connection. Messages are
+routed to the device whose topic they arrived on, and every device publishes
+through one shared outbox. The main loop steps the devices in turn, starting
+from a different device each pass so that no device is always read last, and
+sleeps until the earliest of their next deadlines. Runtime metrics for every
+device are published to retained MQTT topics and can be served over HTTP for
+Prometheus, see metrics.py.
+
+Run a number of simulated starter kit devices with:
+
+    python gateway.py --simulated N [--broker HOST] [--latency S]
+                      [--metrics-port PORT]
+"""
+
+import argparse
+import os
+import time
+
+import paho.mqtt.client as mqtt
+
+import grovebus
+import metrics
+import outbox
+
+# Seconds to sleep when no device has anything scheduled
+IDLE_WAIT = 0.5
+
+
+class Gateway(object):
+    def __init__(self, broker, outbox, client=None, metrics_interval=10.0,
+                 metrics_address=None, clock=time.time):
+        """
+        :param broker: The message broker host
+        :param outbox: The outbox.Outbox shared by every device
+        :param client: The MQTT client, a new one if None
+        :param metrics_interval: Seconds between metrics publishes
+        :param metrics_address: The (host, port) to serve Prometheus metrics
+        on, or None not to serve them
+        """
+        self.broker = broker
+        self.outbox = outbox
+        self.client = client or mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
+        self.devices = []
+        self.routes = {}
+        self.next_device = 0
+        self.clock = clock
+        self.loop_period = grovebus.Timing()
+        self.loop_jitter = grovebus.Timing()
+        self.last_step = None
+        self.metrics = metrics.Metrics(self, metrics_interval, clock)
+        self.metrics_address = metrics_address
+
+    def add(self, device):
+        """ Hosts a device on the gateway's connection
+        :param device: The device.Device
+        :return: None
+        """
+        self.devices.append(device)
+        for topic in device.subscriptions():
+            self.routes[topic] = device
+
+    def on_connect(self, client, userdata, flags, rc):
+        """Called each time the client connects to the message broker
+        :param client: The client object making the connection
+        :param userdata: Arbitrary context specified by the user program
+        :param flags: Response flags sent by the message broker
+        :param rc: the connection result
+        :return: None
+        """
+        # subscribe to every device's topics when connected
+        if self.routes:
+            client.subscribe([(topic, 0) for topic in self.routes])
+        self.outbox.on_connect()
+
+    def on_disconnect(self, client, userdata, rc):
+        self.outbox.on_disconnect()
+
+    def on_publish(self, client, userdata, mid):
+        self.outbox.on_publish(mid)
+
+    def on_message(self, client, userdata, msg):
+        """Called for each message received, passes it to the device it is
+        addressed to
+        :param client: The client object making the connection
+        :param userdata: Arbitrary context specified by the user program
+        :param msg: The message from the MQTT broker
+        :return: None
+        """
+        device = self.routes.get(msg.topic)
+        if device is not None:
+            device.on_message(client, msg)
+
+    def step(self):
+        """ Steps every device once, then sends what they published
+        :return: None
+        """
+        now = self.clock()
+        if self.last_step is not None:
+            self.loop_period.record(now - self.last_step)
+        self.last_step = now
+        count = len(self.devices)
+        for n in range(count):
+            device = self.devices[(self.next_device + n) % count]
+            try:
+                device.step()
+            except (IOError, TypeError) as e:
+                print("Error", device.uuid, e)
+        if count:
+            self.next_device = (self.next_device + 1) % count
+        if self.metrics.time_until_publish() == 0.0:
+            self.metrics.publish(self.client)
+        self.outbox.drain(self.client)
+
+    def next_wakeup(self):
+        """ Returns how long the gateway may sleep before it has work to do
+        :return: Seconds until a device or the outbox is next due
+        """
+        delays = [delay for delay in
+                  [device.next_wakeup() for device in self.devices] +
+                  [self.outbox.time_until_drain(),
+                   self.metrics.time_until_publish()]
+                  if delay is not None]
+        return min(delays) if delays else IDLE_WAIT
+
+    def sleep(self):
+        """ Sleeps until the gateway next has work to do, recording how late
+        it wakes
+        :return: None
+        """
+        delay = self.next_wakeup()
+        start = self.clock()
+        time.sleep(delay)
+        self.loop_jitter.record(max(0.0, self.clock() - start - delay))
+
+    def run(self):
+        """ Connects to the message broker and runs the devices until
+        interrupted
+        :return: None
+        """
+        # Wait for each board to answer rather than for a fixed time
+        for bus in dict((id(device.bus), device.bus)
+                        for device in self.devices).values():
+            bus.wait_ready()
+        # Connect in the background, so that a broker that is down at start
+        # is retried by the network loop while readings wait in the outbox.
+        self.client.connect_async(self.broker)
+        self.client.loop_start()
+
+        try:
+            if self.metrics_address is not None:
+                # Metrics are still published over MQTT if they cannot be
+                # served, e.g. when another instance on the host holds the
+                # port.
+                try:
+                    self.metrics.serve(self.metrics_address)
+                except (IOError, OSError) as e:
+                    print("Error", "metrics not served on %s:%d" %
+                          self.metrics_address, e)
+            for device in self.devices:
+                device.start()
+            while True:
+                self.step()
+                # Sleep until the next sensor read or publish is due.
+                self.sleep()
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            for device in self.devices:
+                device.stop()
+            self.outbox.drain(self.client)
+            self.client.disconnect()
+            self.client.loop_stop()
+            # Anything not acknowledged is sent on the next start
+            self.outbox.close()
+            self.metrics.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run many devices on one MQTT connection")
+    parser.add_argument("--simulated", type=int, default=1,
+                        help="number of simulated starter kit devices")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated seconds per bus call")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this port")
+    parser.add_argument("--outbox", default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "gateway_outbox.dat"))
+    args = parser.parse_args()
+
+    # The simulation must be installed before any device module is imported
+    import grovesim
+    grovesim.install(grovesim.default_bus(latency=args.latency))
+    import uuidgen
+    import IoTDevice
+
+    metrics_address = None
+    if args.metrics_port is not None:
+        metrics_address = ("", args.metrics_port)
+    gateway = Gateway(args.broker, outbox.Outbox(args.outbox),
+                      metrics_address=metrics_address)
+    for i in range(args.simulated):
+        # Each device has its own board, and so its own bus
+        bus = grovesim.default_bus(latency=args.latency, seed=i)
+        device = IoTDevice.build_device(
+            uuidgen.generateUuid(namespace="sim-%d" % i), gateway.outbox,
+            grovebus.BusManager(*grovesim.modules(bus)))
+        print("%s %s" % (device.uuid, device.actuator_topic))
+        gateway.add(device)
+    gateway.run()
+
+
+if __name__ == "__main__":
+    main()
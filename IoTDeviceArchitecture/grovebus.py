@@ -0,0 +1,171 @@
+"""
+Owns the Grove Pi I2C bus. Every call to the grovepi and grove_rgb_lcd modules
+goes through a BusManager, which serializes the calls across threads and times
+each transaction by function and port. Reads that are due together are run
+back to back as one sweep, so the cost of adding a sensor shows up as a
+predictable increase in sweep time. A sweep releases the bus between reads so
+that actuator writes queued behind it wait for at most one transaction. Each
+sensor read in a sweep is also timed by sensor name.
+"""
+
+import bisect
+import threading
+import time
+
+# Upper bounds in seconds of the histogram buckets kept by each Timing. The
+# last bucket counts everything slower.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5)
+
+
+class Timing(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def record(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.last = elapsed
+        self.max = max(self.max, elapsed)
+        self.buckets[bisect.bisect_left(BUCKETS, elapsed)] += 1
+
+    def stats(self):
+        """ Returns the statistics for this timing
+        :return: A dict of counts and times in ms
+        """
+        mean = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "last_ms": round(self.last * 1000, 3),
+            "mean_ms": round(mean * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+
+class BusManager(object):
+    def __init__(self, backend=None, lcd=None, clock=time.time):
+        """
+        :param backend: The module providing the grovepi functions
+        :param lcd: The module providing the grove_rgb_lcd functions
+        """
+        if backend is None:
+            import grovepi as backend
+        if lcd is None:
+            import grove_rgb_lcd as lcd
+        self.backend = backend
+        self.lcd = lcd
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.transactions = {}
+        self.reads = {}
+        self.sweeps = Timing()
+
+    def _function(self, name):
+        """ Returns the named function and whether it addresses a port """
+        try:
+            return getattr(self.backend, name), True
+        except AttributeError:
+            return getattr(self.lcd, name), False
+
+    def _timing(self, key):
+        try:
+            return self.transactions[key]
+        except KeyError:
+            return self.transactions.setdefault(key, Timing())
+
+    def _transaction(self, key, fn, *args):
+        with self.lock:
+            start = self.clock()
+            try:
+                return fn(*args)
+            except IOError:
+                self._timing(key).errors += 1
+                raise
+            finally:
+                self._timing(key).record(self.clock() - start)
+
+    def call(self, name, *args):
+        """ Runs one bus transaction
+        :param name: The grovepi or grove_rgb_lcd function to call
+        :param args: The arguments to the function, the port first if any
+        :return: The function's result
+        """
+        fn, has_port = self._function(name)
+        key = "%s:%s" % (name, args[0]) if has_port and args else name
+        return self._transaction(key, fn, *args)
+
+    def wait_ready(self, timeout=5.0, interval=0.05, sleep=time.sleep):
+        """ Waits for the board to answer, polling its firmware version with
+        a growing interval instead of sleeping a fixed time
+        :param timeout: Most seconds to wait
+        :param interval: Seconds to wait after the first failed poll, doubled
+        after each further one
+        :return: The firmware version
+        :raise IOError: If the board has not answered within the timeout
+        """
+        deadline = self.clock() + timeout
+        while True:
+            try:
+                version = self.call("version")
+                if version != -1:
+                    return version
+            except (IOError, TypeError) as e:
+                # Some grovepi versions fail with a TypeError on a bad read
+                version = e
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                raise IOError("Grove Pi not ready: %s" % (version,))
+            sleep(min(interval, remaining))
+            interval *= 2
+
+    def write_lcd(self, address, register, value):
+        """ Writes one byte to a register of the LCD's text or backlight
+        controller, for drivers that update the display piecemeal
+        :param address: The I2C address of the controller
+        :param register: The register to write
+        :param value: The byte to write
+        :return: None
+        """
+        self._transaction("lcd:0x%02x" % address, self.lcd.bus.write_byte_data,
+                          address, register, value)
+
+    def sweep(self, reads):
+        """ Runs a batch of reads back to back. A read that fails with IOError
+        does not stop the sweep.
+        :param reads: A list of (name, read) tuples where read is called with
+        no arguments
+        :return: A list of (name, result) tuples for the reads that succeeded
+        """
+        results = []
+        start = self.clock()
+        for name, read in reads:
+            try:
+                timing = self.reads[name]
+            except KeyError:
+                timing = self.reads[name] = Timing()
+            read_start = self.clock()
+            try:
+                results.append((name, read()))
+            except IOError as e:
+                self.sweeps.errors += 1
+                timing.errors += 1
+                print("Error", name, e)
+            timing.record(self.clock() - read_start)
+        self.sweeps.record(self.clock() - start)
+        return results
+
+    def stats(self):
+        """ Returns timing statistics for every transaction and for sweeps
+        :return: A dict of transaction key to statistics, with sweeps under
+        the "sweep" key
+        """
+        stats = dict((key, timing.stats())
+                     for key, timing in self.transactions.items())
+        stats["sweep"] = self.sweeps.stats()
+        return stats
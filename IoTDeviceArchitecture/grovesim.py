@@ -0,0 +1,302 @@
+"""
+A simulated Grove Pi backend for running and profiling device code without a
+board attached. SimulatedBus provides the same functions as the grovepi and
+grove_rgb_lcd modules, with configurable per-call latency, NaN and IOError
+injection, and scripted waveforms for each input port. install() registers the
+simulation in place of the real modules so unmodified scripts pick it up on
+import.
+
+Run any script against the simulation with:
+
+    python grovesim.py [--latency S] [--nan-rate P] [--ioerror-rate P] script.py
+"""
+
+import argparse
+import math
+import os
+import random
+import runpy
+import sys
+import time
+import types
+
+
+# Waveforms are callables taking the seconds elapsed since the bus was created
+# and returning the value to report.
+
+
+def constant(value):
+    return lambda t: value
+
+
+def sine(mean, amplitude, period):
+    return lambda t: mean + amplitude * math.sin(2 * math.pi * t / period)
+
+
+def square(low, high, period):
+    return lambda t: high if (t % period) < period / 2.0 else low
+
+
+def noise(waveform, amplitude, rng=random):
+    return lambda t: waveform(t) + rng.uniform(-amplitude, amplitude)
+
+
+def scripted(values, interval):
+    """ Steps through a list of values, one every interval seconds, looping
+    :param values: The values to report in order
+    :param interval: Seconds each value is held for
+    :return: The waveform
+    """
+    values = list(values)
+    return lambda t: values[int(t / interval) % len(values)]
+
+
+class SimulatedBus(object):
+    LATENCY = 0.0
+    NAN_RATE = 0.0
+    IOERROR_RATE = 0.0
+
+    def __init__(self, latency=LATENCY, nan_rate=NAN_RATE,
+                 ioerror_rate=IOERROR_RATE, seed=None, clock=time.time,
+                 sleep=time.sleep):
+        """
+        :param latency: Seconds each call takes, or a dict of function name to
+        seconds with an optional "default" entry
+        :param nan_rate: Probability that a dht call returns NaN values
+        :param ioerror_rate: Probability that any call raises IOError
+        :param seed: Seed for the fault injection random number generator
+        """
+        if not isinstance(latency, dict):
+            latency = {"default": latency}
+        self.latency = latency
+        self.nan_rate = nan_rate
+        self.ioerror_rate = ioerror_rate
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.sleep = sleep
+        self.start = clock()
+        self.analog_inputs = {}
+        self.digital_inputs = {}
+        self.ultrasonic_inputs = {}
+        self.dht_inputs = {}
+        self.pin_modes = {}
+        self.outputs = {}
+        self.lcd = SimulatedLCD(self)
+        self.calls = {}
+
+    def set_analog(self, port, waveform):
+        self.analog_inputs[port] = waveform
+
+    def set_digital(self, port, waveform):
+        self.digital_inputs[port] = waveform
+
+    def set_ultrasonic(self, port, waveform):
+        self.ultrasonic_inputs[port] = waveform
+
+    def set_dht(self, port, waveform):
+        """ Sets the (temperature, humidity) waveform for a DHT sensor port """
+        self.dht_inputs[port] = waveform
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        delay = self.latency.get(name, self.latency.get("default", 0.0))
+        if delay:
+            self.sleep(delay)
+        if self.ioerror_rate and self.rng.random() < self.ioerror_rate:
+            raise IOError("simulated I2C error in " + name)
+        return self.clock() - self.start
+
+    # grovepi
+
+    def pinMode(self, pin, mode):
+        self._call("pinMode")
+        self.pin_modes[pin] = mode
+
+    def analogRead(self, pin):
+        t = self._call("analogRead")
+        waveform = self.analog_inputs.get(pin, constant(0))
+        return max(0, min(1023, int(waveform(t))))
+
+    def digitalRead(self, pin):
+        t = self._call("digitalRead")
+        return 1 if self.digital_inputs.get(pin, constant(0))(t) else 0
+
+    def ultrasonicRead(self, pin):
+        t = self._call("ultrasonicRead")
+        return int(self.ultrasonic_inputs.get(pin, constant(400))(t))
+
+    def dht(self, pin, module_type):
+        t = self._call("dht")
+        if self.nan_rate and self.rng.random() < self.nan_rate:
+            return [float("nan"), float("nan")]
+        temperature, humidity = self.dht_inputs.get(pin, constant((20.0, 50.0)))(t)
+        return [float(temperature), float(humidity)]
+
+    def analogWrite(self, pin, value):
+        self._call("analogWrite")
+        self.outputs[pin] = value
+
+    def digitalWrite(self, pin, value):
+        self._call("digitalWrite")
+        self.outputs[pin] = value
+
+    def version(self):
+        self._call("version")
+        return "1.2.7"
+
+    # grove_rgb_lcd
+
+    @property
+    def lcd_text(self):
+        return "\n".join("".join(row).rstrip() for row in self.lcd.rows)
+
+    @property
+    def lcd_rgb(self):
+        return self.lcd.rgb
+
+    def textCommand(self, cmd):
+        self.lcd.write_byte_data(DISPLAY_TEXT_ADDR, 0x80, cmd)
+
+    def setRGB(self, r, g, b):
+        self._call("setRGB")
+        self.lcd.rgb = (r, g, b)
+
+    def setText(self, text):
+        self._call("setText")
+        self.lcd.clear()
+        self.setText_norefresh(text)
+
+    def setText_norefresh(self, text):
+        self._call("setText_norefresh")
+        # Wraps the same way grove_rgb_lcd does, at a newline or 16 characters
+        rows = [[" "] * 16, [" "] * 16]
+        row = col = 0
+        for c in text:
+            if c == "\n" or col == 16:
+                row += 1
+                col = 0
+                if row == 2:
+                    break
+                if c == "\n":
+                    continue
+            rows[row][col] = c
+            col += 1
+        self.lcd.rows = rows
+
+
+DISPLAY_RGB_ADDR = 0x62
+DISPLAY_TEXT_ADDR = 0x3e
+
+
+class SimulatedLCD(object):
+    """ Emulates the LCD's text and backlight controllers at the register
+    level, standing in for the smbus object grove_rgb_lcd writes through
+    """
+    RGB_REGISTERS = {4: 0, 3: 1, 2: 2}
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.rgb = (0, 0, 0)
+        self.cursor = 0
+        self.clear()
+
+    def clear(self):
+        self.rows = [[" "] * 16, [" "] * 16]
+        self.cursor = 0
+
+    def write_byte_data(self, address, register, value):
+        self.bus._call("write_byte_data")
+        if address == DISPLAY_RGB_ADDR:
+            if register in self.RGB_REGISTERS:
+                rgb = list(self.rgb)
+                rgb[self.RGB_REGISTERS[register]] = value
+                self.rgb = tuple(rgb)
+        elif register == 0x80:
+            if value == 0x01:
+                self.clear()
+            elif value & 0x80:
+                self.cursor = value & 0x7f
+        elif register == 0x40:
+            row, col = divmod(self.cursor, 0x40)
+            if row < 2 and col < 16:
+                self.rows[row][col] = chr(value)
+            self.cursor += 1
+
+
+GROVEPI_FUNCTIONS = ("pinMode", "analogRead", "digitalRead", "ultrasonicRead",
+                     "dht", "analogWrite", "digitalWrite", "version")
+LCD_FUNCTIONS = ("setRGB", "setText", "setText_norefresh", "textCommand")
+
+
+def modules(bus):
+    """ Creates stand-ins for the grovepi and grove_rgb_lcd modules backed by
+    a simulated bus, e.g. for a grovebus.BusManager
+    :param bus: The SimulatedBus
+    :return: The (grovepi, grove_rgb_lcd) modules
+    """
+    created = []
+    for module_name, functions in (("grovepi", GROVEPI_FUNCTIONS),
+                                   ("grove_rgb_lcd", LCD_FUNCTIONS)):
+        module = types.ModuleType(module_name)
+        for name in functions:
+            setattr(module, name, getattr(bus, name))
+        module.simulated_bus = bus
+        created.append(module)
+    lcd = created[1]
+    lcd.bus = bus.lcd
+    lcd.DISPLAY_RGB_ADDR = DISPLAY_RGB_ADDR
+    lcd.DISPLAY_TEXT_ADDR = DISPLAY_TEXT_ADDR
+    return tuple(created)
+
+
+def install(bus=None):
+    """ Registers a simulated bus as the grovepi and grove_rgb_lcd modules.
+    Must be called before any module importing them is imported.
+    :param bus: The SimulatedBus to install, a default one if None
+    :return: The installed SimulatedBus
+    """
+    if bus is None:
+        bus = SimulatedBus()
+    sys.modules["grovepi"], sys.modules["grove_rgb_lcd"] = modules(bus)
+    return bus
+
+
+def default_bus(**kwargs):
+    """ Creates a bus with noisy waveforms on the starter kit's input ports
+    :return: The SimulatedBus
+    """
+    bus = SimulatedBus(**kwargs)
+    bus.set_analog(0, noise(sine(300, 150, 5.0), 20, bus.rng))  # sound
+    bus.set_analog(1, noise(sine(600, 200, 60.0), 5, bus.rng))  # light
+    bus.set_analog(2, noise(constant(512), 2, bus.rng))  # potentiometer
+    bus.set_digital(3, square(0, 1, 10.0))  # button
+    bus.set_ultrasonic(4, scripted([120, 118, 35, 36, 119], 2.0))
+    bus.set_dht(7, lambda t: (21.0 + math.sin(t / 600.0), 45.0))
+    return bus
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a script against a simulated Grove Pi")
+    parser.add_argument("--latency", type=float, default=SimulatedBus.LATENCY,
+                        help="seconds per bus call")
+    parser.add_argument("--nan-rate", type=float,
+                        default=SimulatedBus.NAN_RATE,
+                        help="probability of a NaN dht reading")
+    parser.add_argument("--ioerror-rate", type=float,
+                        default=SimulatedBus.IOERROR_RATE,
+                        help="probability of an IOError on any call")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    install(default_bus(latency=args.latency, nan_rate=args.nan_rate,
+                        ioerror_rate=args.ioerror_rate, seed=args.seed))
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    runpy.run_path(args.script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
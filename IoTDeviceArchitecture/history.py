@@ -0,0 +1,176 @@
+"""
+Keeps a fixed amount of recent history for each sensor on the device. Every
+reading is recorded into a set of tiers, for example raw samples, 1 second and
+1 minute buckets, each held in preallocated arrays used as ring buffers so
+memory does not grow with uptime. Downsampled tiers keep the mean, minimum and
+maximum of each bucket. Readings that are dicts, such as the DHT sensor's, are
+recorded as one series per numeric field, named "sensor.field".
+
+Queries arrive as JSON requests such as
+
+    {"id": 1, "sensor": "light_sensor", "tier": "1s", "since": 1519609945872,
+     "limit": 120}
+
+and are answered with the matching points, oldest first, as
+[timestamp ms, mean, min, max] lists.
+"""
+
+import array
+import numbers
+import threading
+import time
+
+# (name, bucket seconds, capacity). A bucket of 0 keeps every raw sample.
+DEFAULT_TIERS = (
+    ("raw", 0, 600),
+    ("1s", 1, 600),
+    ("1m", 60, 1440)
+)
+
+
+class Tier(object):
+    __slots__ = ("name", "resolution", "capacity", "times", "means", "mins",
+                 "maxs", "size", "head", "bucket_start", "bucket_sum",
+                 "bucket_min", "bucket_max", "bucket_count")
+
+    def __init__(self, name, resolution, capacity):
+        self.name = name
+        self.resolution = resolution
+        self.capacity = capacity
+        self.times = array.array("d", [0.0]) * capacity
+        self.means = array.array("d", [0.0]) * capacity
+        self.mins = array.array("d", [0.0]) * capacity
+        self.maxs = array.array("d", [0.0]) * capacity
+        self.size = 0
+        self.head = 0
+        self.bucket_start = None
+        self.bucket_sum = 0.0
+        self.bucket_min = 0.0
+        self.bucket_max = 0.0
+        self.bucket_count = 0
+
+    def _push(self, t, mean, minimum, maximum):
+        i = self.head
+        self.times[i] = t
+        self.means[i] = mean
+        self.mins[i] = minimum
+        self.maxs[i] = maximum
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _close_bucket(self):
+        self._push(self.bucket_start, self.bucket_sum / self.bucket_count,
+                   self.bucket_min, self.bucket_max)
+        self.bucket_start = None
+
+    def add(self, t, value):
+        """ Records a sample
+        :param t: The time of the sample in seconds
+        :param value: The sample
+        :return: None
+        """
+        if not self.resolution:
+            self._push(t, value, value, value)
+            return
+        bucket = t - t % self.resolution
+        if self.bucket_start is not None and bucket != self.bucket_start:
+            self._close_bucket()
+        if self.bucket_start is None:
+            self.bucket_start = bucket
+            self.bucket_sum = 0.0
+            self.bucket_min = self.bucket_max = value
+            self.bucket_count = 0
+        self.bucket_sum += value
+        self.bucket_min = min(self.bucket_min, value)
+        self.bucket_max = max(self.bucket_max, value)
+        self.bucket_count += 1
+
+    def query(self, since=None, limit=None):
+        """ Returns the recorded points, oldest first. The bucket still being
+        filled is not included.
+        :param since: Only points at or after this time in seconds
+        :param limit: Only the most recent this many points
+        :return: A list of [timestamp ms, mean, min, max] lists
+        """
+        start = (self.head - self.size) % self.capacity
+        points = []
+        for n in range(self.size):
+            i = (start + n) % self.capacity
+            if since is not None and self.times[i] < since:
+                continue
+            points.append([int(self.times[i] * 1000), self.means[i],
+                           self.mins[i], self.maxs[i]])
+        if limit is not None:
+            points = points[-limit:] if limit > 0 else []
+        return points
+
+
+class HistoryStore(object):
+    def __init__(self, tiers=DEFAULT_TIERS, clock=time.time):
+        """
+        :param tiers: A sequence of (name, bucket seconds, capacity) tuples
+        """
+        self.tier_specs = tiers
+        self.clock = clock
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def _record(self, name, value, t):
+        try:
+            tiers = self.series[name]
+        except KeyError:
+            tiers = self.series[name] = [Tier(*spec)
+                                         for spec in self.tier_specs]
+        for tier in tiers:
+            tier.add(t, value)
+
+    def record(self, name, value, t=None):
+        """ Records a sensor reading. Non-numeric readings and fields are
+        ignored.
+        :param name: The sensor name
+        :param value: The reading, a number or a dict of numbers
+        :param t: The time of the reading in seconds, now if None
+        :return: None
+        """
+        if t is None:
+            t = self.clock()
+        with self.lock:
+            if isinstance(value, dict):
+                for field, field_value in value.items():
+                    if isinstance(field_value, numbers.Number):
+                        self._record(name + "." + field, field_value, t)
+            elif isinstance(value, numbers.Number):
+                self._record(name, value, t)
+
+    def query(self, name, tier="raw", since=None, limit=None):
+        """ Returns recent history for a series
+        :param name: The series name
+        :param tier: The tier name
+        :param since: Only points at or after this time in seconds
+        :param limit: Only the most recent this many points
+        :return: A list of [timestamp ms, mean, min, max] lists
+        """
+        with self.lock:
+            for candidate in self.series[name]:
+                if candidate.name == tier:
+                    return candidate.query(since, limit)
+        raise KeyError(tier)
+
+    def handle_request(self, request):
+        """ Answers a history request
+        :param request: A dict with "sensor" and optional "tier", "since"
+        (ms) and "limit" entries, and an "id" echoed back in the response
+        :return: The response dict
+        """
+        response = {"id": request.get("id"), "sensor": request.get("sensor"),
+                    "tier": request.get("tier", "raw")}
+        since = request.get("since")
+        try:
+            response["points"] = self.query(
+                response["sensor"], response["tier"],
+                since / 1000.0 if since is not None else None,
+                request.get("limit"))
+        except (KeyError, TypeError):
+            response["error"] = "unknown sensor or tier"
+            response["sensors"] = sorted(self.series)
+        return response
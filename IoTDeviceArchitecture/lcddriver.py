@@ -0,0 +1,158 @@
+"""
+A framebuffer driver for the Grove RGB LCD. The driver keeps a shadow copy of
+the 16x2 display and the backlight colour, and on each refresh sends only the
+characters and colour channels that differ from it, instead of clearing and
+redrawing the whole display with setText. Refreshes are rate limited; updates
+that arrive sooner are merged and sent at the next refresh. A refresh that
+fails is retried no sooner than the rate limit allows, backing off while the
+display keeps failing.
+"""
+
+import time
+
+COLUMNS = 16
+ROWS = 2
+
+# Controller commands, see grove_rgb_lcd
+CLEAR_DISPLAY = 0x01
+DISPLAY_ON = 0x08 | 0x04
+TWO_LINES = 0x28
+SET_ADDRESS = 0x80
+ROW_ADDRESS = 0x40
+TEXT_COMMAND_REGISTER = 0x80
+TEXT_DATA_REGISTER = 0x40
+RGB_REGISTERS = (4, 3, 2)
+
+
+def layout(text):
+    """ Lays text out on the display the way grove_rgb_lcd.setText does,
+    wrapping at a newline or after 16 characters
+    :param text: The text to display
+    :return: A list of ROWS * COLUMNS characters
+    """
+    frame = [" "] * (ROWS * COLUMNS)
+    row = col = 0
+    for c in text:
+        if c == "\n" or col == COLUMNS:
+            row += 1
+            col = 0
+            if row == ROWS:
+                break
+            if c == "\n":
+                continue
+        frame[row * COLUMNS + col] = c
+        col += 1
+    return frame
+
+
+class FramebufferLCD(object):
+    def __init__(self, bus, min_interval=0.1, max_backoff=5.0,
+                 clock=time.time, sleep=time.sleep):
+        """
+        :param bus: The grovebus.BusManager the display is attached to
+        :param min_interval: Fewest seconds between refreshes
+        :param max_backoff: Most seconds between retries of a failing refresh
+        """
+        self.bus = bus
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        # Seconds to wait before retrying a failed refresh, 0 after a success
+        self.retry_interval = 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self.frame = None
+        self.rgb = None
+        self.pending_frame = None
+        self.pending_rgb = None
+        self.last_refresh = None
+
+    def update(self, text=None, rgb=None):
+        """ Sets the text and/or colour to display, refreshing the display
+        now if the rate limit allows
+        :param text: The text to display, or None to leave it unchanged
+        :param rgb: The (r, g, b) backlight colour, or None to leave it
+        unchanged
+        :return: None
+        """
+        if text is not None:
+            self.pending_frame = layout(text)
+        if rgb is not None:
+            self.pending_rgb = tuple(int(channel) for channel in rgb)
+        self.refresh()
+
+    def time_until_refresh(self):
+        """ Returns the number of seconds until pending changes can be sent
+        :return: Seconds until the next refresh, or None if nothing is pending
+        """
+        if self.pending_frame is None and self.pending_rgb is None:
+            return None
+        if self.last_refresh is None:
+            return 0.0
+        interval = max(self.min_interval, self.retry_interval)
+        return max(0.0, self.last_refresh + interval - self.clock())
+
+    def refresh(self):
+        """ Sends pending changes if the rate limit allows
+        :return: None
+        """
+        if self.time_until_refresh() == 0.0:
+            self.flush()
+
+    def flush(self):
+        """ Sends pending changes immediately
+        :return: None
+        """
+        try:
+            if self.pending_rgb is not None:
+                self._send_rgb(self.pending_rgb)
+                self.pending_rgb = None
+            if self.pending_frame is not None:
+                self._send_frame(self.pending_frame)
+                self.pending_frame = None
+        except IOError:
+            # The changes stay pending, so without a delay the dispatcher
+            # would retry them at once, holding the bus in a tight loop.
+            self.retry_interval = min(max(self.retry_interval * 2,
+                                          self.min_interval),
+                                      self.max_backoff)
+            self.last_refresh = self.clock()
+            raise
+        self.retry_interval = 0.0
+        self.last_refresh = self.clock()
+
+    def _send_rgb(self, rgb):
+        if self.rgb is None:
+            # setRGB also initializes the backlight controller
+            self.bus.call("setRGB", *rgb)
+        else:
+            for register, old, new in zip(RGB_REGISTERS, self.rgb, rgb):
+                if old != new:
+                    self.bus.write_lcd(self.bus.lcd.DISPLAY_RGB_ADDR,
+                                       register, new)
+        self.rgb = rgb
+
+    def _command(self, command):
+        self.bus.write_lcd(self.bus.lcd.DISPLAY_TEXT_ADDR,
+                           TEXT_COMMAND_REGISTER, command)
+
+    def _send_frame(self, frame):
+        if self.frame is None:
+            # The display contents are unknown until it has been cleared
+            self._command(CLEAR_DISPLAY)
+            self.sleep(0.05)
+            self._command(DISPLAY_ON)
+            self._command(TWO_LINES)
+            self.sleep(0.05)
+            self.frame = [" "] * (ROWS * COLUMNS)
+        cursor = None
+        for index, (old, new) in enumerate(zip(self.frame, frame)):
+            if old == new:
+                continue
+            if cursor != index:
+                row, col = divmod(index, COLUMNS)
+                self._command(SET_ADDRESS | (row * ROW_ADDRESS + col))
+            self.bus.write_lcd(self.bus.lcd.DISPLAY_TEXT_ADDR,
+                               TEXT_DATA_REGISTER, ord(new))
+            self.frame[index] = new
+            # The cursor advances within a row but not onto the next one
+            cursor = index + 1 if (index + 1) % COLUMNS else None
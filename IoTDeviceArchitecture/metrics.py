@@ -0,0 +1,220 @@
+"""
+Runtime metrics for the devices on a gateway: per-sensor read latency
+histograms, which sensors are returning a cached reading because fresh reads
+are failing, the main loop's period and jitter, the depth of each device's
+command queue, publish counts and bytes, and I/O errors per bus function and
+port. The metrics are served as Prometheus text over HTTP, and a JSON summary
+of each device is published to a retained MQTT topic so the latest figures for
+every device in the fleet can be read from the broker at any time.
+"""
+
+import json
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import grovebus
+
+METRICS_TOPIC = "SNHU/IT697/metrics/"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _sample(name, labels):
+    if not labels:
+        return name
+    return "%s{%s}" % (name, ",".join(
+        '%s="%s"' % (label, str(value).replace('"', '\\"'))
+        for label, value in sorted(labels.items())))
+
+
+def _bound(bound):
+    return "+Inf" if bound is None else repr(bound)
+
+
+def render(families):
+    """ Renders metrics in the Prometheus text exposition format
+    :param families: A list of (name, type, help, samples) tuples, where
+    samples is a list of (labels dict, value) tuples and the value of a
+    histogram is a grovebus.Timing
+    :return: The text
+    """
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in samples:
+            if kind != "histogram":
+                lines.append("%s %s" % (_sample(name, labels), value))
+                continue
+            cumulative = 0
+            for bound, count in zip(grovebus.BUCKETS + (None,),
+                                    value.buckets):
+                cumulative += count
+                bucket_labels = dict(labels, le=_bound(bound))
+                lines.append("%s %d" % (_sample(name + "_bucket",
+                                                bucket_labels), cumulative))
+            lines.append("%s %r" % (_sample(name + "_sum", labels),
+                                    value.total))
+            lines.append("%s %d" % (_sample(name + "_count", labels),
+                                    value.count))
+    return "\n".join(lines) + "\n"
+
+
+class Metrics(object):
+    def __init__(self, gateway, interval=10.0, clock=time.time):
+        """
+        :param gateway: The gateway.Gateway whose devices are measured
+        :param interval: Seconds between MQTT metrics publishes
+        """
+        self.gateway = gateway
+        self.interval = interval
+        self.clock = clock
+        self.next_publish = clock() + interval
+        # (time, messages, bytes) per device at the last publish, for rates
+        self.last_counts = {}
+        self.server = None
+
+    def families(self):
+        """ Collects the current metrics
+        :return: A list of (name, type, help, samples) tuples, see render
+        """
+        gateway = self.gateway
+        reads = []
+        io_errors = []
+        depth = []
+        messages = []
+        sent_bytes = []
+        stale = []
+        for device in list(gateway.devices):
+            labels = {"device": device.uuid}
+            for sensor_name, sensor, _, _ in device.sensors:
+                if hasattr(sensor, "stale"):
+                    stale.append((dict(labels, sensor=sensor_name),
+                                  int(sensor.stale)))
+            for sensor_name, timing in list(device.bus.reads.items()):
+                reads.append((dict(labels, sensor=sensor_name), timing))
+            for key, timing in list(device.bus.transactions.items()):
+                function, _, port = key.partition(":")
+                io_errors.append((dict(labels, function=function, port=port),
+                                  timing.errors))
+            depth.append((labels, device.commands.qsize()))
+            messages.append((labels, device.published))
+            sent_bytes.append((labels, device.published_bytes))
+        outbox_stats = gateway.outbox.stats()
+        return [
+            ("grove_sensor_read_seconds", "histogram",
+             "Time taken by each sensor read", reads),
+            ("grove_sensor_stale", "gauge",
+             "1 while a sensor's reading is its last good one rather than "
+             "a fresh one", stale),
+            ("grove_io_errors_total", "counter",
+             "Bus transactions that failed with an I/O error", io_errors),
+            ("device_command_queue_depth", "gauge",
+             "Actuators with a command waiting to be applied", depth),
+            ("device_published_messages_total", "counter",
+             "Sensor data messages published", messages),
+            ("device_published_bytes_total", "counter",
+             "Sensor data bytes published", sent_bytes),
+            ("gateway_loop_period_seconds", "histogram",
+             "Time between main loop iterations", [({}, gateway.loop_period)]),
+            ("gateway_loop_jitter_seconds", "histogram",
+             "How late the main loop woke after each sleep",
+             [({}, gateway.loop_jitter)]),
+            ("gateway_outbox_bytes", "gauge",
+             "Bytes of messages waiting in the outbox",
+             [({}, outbox_stats["bytes"])]),
+            ("gateway_outbox_dropped_total", "counter",
+             "Messages dropped because the outbox was full",
+             [({}, outbox_stats["dropped"])])
+        ]
+
+    def prometheus(self):
+        """ Returns the metrics as Prometheus text """
+        return render(self.families())
+
+    def summary(self, device, now):
+        """ Summarizes a device's metrics for the metrics topic
+        :param device: The device.Device
+        :param now: The current time in seconds
+        :return: The summary dict
+        """
+        last_time, last_messages, last_bytes = self.last_counts.get(
+            device.uuid, (None, 0, 0))
+        self.last_counts[device.uuid] = (now, device.published,
+                                         device.published_bytes)
+        elapsed = now - last_time if last_time is not None else 0
+        rate = byte_rate = 0.0
+        if elapsed > 0:
+            rate = (device.published - last_messages) / elapsed
+            byte_rate = (device.published_bytes - last_bytes) / elapsed
+        return {
+            "timestamp": int(now * 1000),
+            "reads": dict((sensor_name, timing.stats()) for sensor_name, timing
+                          in list(device.bus.reads.items())),
+            "loop_period": self.gateway.loop_period.stats(),
+            "loop_jitter": self.gateway.loop_jitter.stats(),
+            "stale": sorted(sensor_name for sensor_name, sensor, _, _
+                            in device.sensors if getattr(sensor, "stale",
+                                                         False)),
+            "command_queue_depth": device.commands.qsize(),
+            "published": device.published,
+            "published_bytes": device.published_bytes,
+            "publish_rate": round(rate, 3),
+            "publish_byte_rate": round(byte_rate, 1),
+            "io_errors": dict((key, timing.errors) for key, timing
+                              in list(device.bus.transactions.items())
+                              if timing.errors)
+        }
+
+    def time_until_publish(self):
+        """ Returns the number of seconds until the metrics are next due """
+        return max(0.0, self.next_publish - self.clock())
+
+    def publish(self, client):
+        """ Publishes each device's summary to its retained metrics topic
+        :param client: The MQTT client to publish with
+        :return: None
+        """
+        now = self.clock()
+        self.next_publish = now + self.interval
+        for device in self.gateway.devices:
+            client.publish(METRICS_TOPIC + device.uuid,
+                           json.dumps(self.summary(device, now)), retain=True)
+
+    def serve(self, address):
+        """ Serves the Prometheus text on a background thread
+        :param address: The (host, port) to listen on
+        :return: None
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer(address, Handler)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  name="metrics-http")
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,263 @@
+"""
+A persistent store-and-forward outbox for MQTT publishing. Messages are
+appended to a fixed-size, memory-mapped file on local disk and sent from there
+in order, so readings taken while the broker is unreachable are neither lost
+nor left to pile up in the client's memory. A message is removed from the
+outbox only once the broker acknowledges it, which requires QoS 1. After a
+reconnect, everything unacknowledged is replayed in order, in bulk, at a
+limited rate so that a backlog does not flood the broker.
+
+When an append does not fit, the live messages are first compacted to the
+start of the file. If it still does not fit, the oldest messages are dropped.
+
+The file holds a header of (magic, head, tail) followed by the records between
+head and tail, each a (payload length, topic length) prefix, the topic and the
+payload.
+"""
+
+import collections
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"OBX1"
+HEADER = struct.Struct("<4s4xQQ")
+HEADER_SIZE = 32
+RECORD = struct.Struct("<IH")
+
+
+class Outbox(object):
+    def __init__(self, path, size=1024 * 1024, rate=20.0, burst=100,
+                 max_inflight=20, clock=time.time):
+        """
+        :param path: The outbox file, created if it does not exist
+        :param size: The size of the file in bytes
+        :param rate: Most messages sent per second when replaying a backlog
+        :param burst: Most messages sent at once before the rate applies
+        :param max_inflight: Most messages sent but not yet acknowledged
+        """
+        self.path = path
+        self.size = size
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.connected = False
+        self.replay = False
+        self.inflight = collections.deque()
+        self.acked = set()
+        # Filled by the client's network thread, emptied by drain()
+        self.acknowledgements = collections.deque()
+        self.tokens = float(burst)
+        self.last_refill = clock()
+        self.appended = 0
+        self.sent = 0
+        self.dropped = 0
+        self._open()
+
+    def _open(self):
+        new = not os.path.exists(self.path)
+        self.file = open(self.path, "a+b")
+        if os.path.getsize(self.path) < self.size:
+            self.file.truncate(self.size)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        magic, head, tail = HEADER.unpack_from(self.map, 0)
+        if new or magic != MAGIC or not (
+                HEADER_SIZE <= head <= tail <= self.size):
+            head = tail = HEADER_SIZE
+        self.head = head
+        self.tail = tail
+        self.send_offset = head
+        self._write_header()
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, self.head, self.tail)
+
+    def _record_at(self, offset):
+        """ Returns the topic, payload and end offset of a record """
+        payload_len, topic_len = RECORD.unpack_from(self.map, offset)
+        start = offset + RECORD.size
+        topic = self.map[start:start + topic_len].decode("utf-8")
+        start += topic_len
+        payload = self.map[start:start + payload_len]
+        return topic, payload, start + payload_len
+
+    def _compact(self):
+        """ Moves the live records to the start of the data area """
+        shift = self.head - HEADER_SIZE
+        if not shift:
+            return
+        length = self.tail - self.head
+        if length:
+            self.map.move(HEADER_SIZE, self.head, length)
+        self.head -= shift
+        self.tail -= shift
+        self.send_offset -= shift
+        self.inflight = collections.deque((mid, end - shift)
+                                          for mid, end in self.inflight)
+        self._write_header()
+
+    def _drop_oldest(self):
+        self.head = self._record_at(self.head)[2]
+        self.dropped += 1
+        while self.inflight and self.inflight[0][1] <= self.head:
+            self.acked.discard(self.inflight.popleft()[0])
+        self.send_offset = max(self.send_offset, self.head)
+
+    def __len__(self):
+        """ Returns the number of bytes of messages in the outbox """
+        return self.tail - self.head
+
+    def append(self, topic, payload):
+        """ Adds a message to the end of the outbox
+        :param topic: The topic to publish to
+        :param payload: The message payload
+        :return: True if the message was stored, False if it can never fit
+        """
+        topic = topic.encode("utf-8")
+        if not isinstance(payload, bytes):
+            payload = payload.encode("utf-8")
+        length = RECORD.size + len(topic) + len(payload)
+        with self.lock:
+            if length > self.size - HEADER_SIZE:
+                self.dropped += 1
+                return False
+            if self.tail + length > self.size:
+                self._compact()
+            while self.tail + length > self.size:
+                self._drop_oldest()
+                self._compact()
+            offset = self.tail
+            RECORD.pack_into(self.map, offset, len(payload), len(topic))
+            offset += RECORD.size
+            self.map[offset:offset + len(topic)] = topic
+            offset += len(topic)
+            self.map[offset:offset + len(payload)] = payload
+            self.tail = offset + len(payload)
+            self._write_header()
+            self.appended += 1
+            return True
+
+    # The client callbacks below run on its network thread, sometimes while it
+    # holds its own locks, so they never take the outbox lock. drain() acts on
+    # what they record.
+
+    def on_connect(self):
+        """ Called when the client connects. Anything sent but not
+        acknowledged before is sent again, from the oldest message.
+        :return: None
+        """
+        self.replay = True
+        self.connected = True
+
+    def on_disconnect(self):
+        self.connected = False
+
+    def on_publish(self, mid):
+        """ Called when the broker acknowledges a message
+        :param mid: The message id returned by publish
+        :return: None
+        """
+        self.acknowledgements.append(mid)
+
+    def _advance(self):
+        # Messages are removed in order, so an acknowledgement only frees
+        # space once every older message has been acknowledged too.
+        while self.acknowledgements:
+            self.acked.add(self.acknowledgements.popleft())
+        moved = False
+        while self.inflight and self.inflight[0][0] in self.acked:
+            mid, end = self.inflight.popleft()
+            self.acked.discard(mid)
+            self.head = end
+            moved = True
+        if not self.inflight:
+            self.acked.clear()
+        if moved:
+            if self.head == self.tail and not self.inflight:
+                self.head = self.tail = self.send_offset = HEADER_SIZE
+            self._write_header()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(float(self.burst),
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def pending(self):
+        """ Returns whether there are messages waiting to be sent """
+        return self.send_offset < self.tail
+
+    def time_until_drain(self):
+        """ Returns the number of seconds until more messages can be sent
+        :return: Seconds until the next message may be sent, or None if there
+        is nothing to send
+        """
+        with self.lock:
+            if not (self.connected and self.pending()):
+                return None
+            if len(self.inflight) >= self.max_inflight:
+                # Waiting on acknowledgements rather than on time
+                return None
+            self._refill()
+            if self.tokens >= 1:
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def drain(self, client, qos=1):
+        """ Sends waiting messages in order, as far as the rate limit and the
+        number of unacknowledged messages allow
+        :param client: The MQTT client to publish with
+        :param qos: The QoS to publish at, 1 or 2 for messages to be removed
+        only when acknowledged
+        :return: The number of messages sent
+        """
+        sent = 0
+        with self.lock:
+            self._advance()
+            if self.replay:
+                self.replay = False
+                self.inflight.clear()
+                self.acked.clear()
+                self.send_offset = self.head
+            if not self.connected:
+                return 0
+            self._refill()
+            while (self.pending() and self.tokens >= 1 and
+                   len(self.inflight) < self.max_inflight):
+                topic, payload, end = self._record_at(self.send_offset)
+                rc, mid = client.publish(topic, payload, qos)
+                if rc:
+                    break
+                self.inflight.append((mid, end))
+                self.send_offset = end
+                self.tokens -= 1
+                sent += 1
+                # The acknowledgement may already have arrived
+                self._advance()
+            self.sent += sent
+        return sent
+
+    def sync(self):
+        """ Flushes the outbox to disk """
+        with self.lock:
+            self.map.flush()
+
+    def close(self):
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "bytes": self.tail - self.head,
+                "inflight": len(self.inflight),
+                "appended": self.appended,
+                "sent": self.sent,
+                "dropped": self.dropped
+            }
@@ -0,0 +1,126 @@
+"""
+A deadline based scheduler for periodic sensor reads. Each task is given a real
+period, expressed either as a rate in Hz or as an interval in milliseconds, and
+is run only when its deadline arrives. The main loop asks the scheduler how long
+it may sleep until the next deadline instead of spinning. For each task the
+scheduler records how late each run started (jitter) and how many deadlines were
+missed because earlier work overran.
+"""
+
+import heapq
+import time
+
+
+class Task(object):
+    def __init__(self, name, callback, period, start):
+        self.name = name
+        self.callback = callback
+        self.period = period
+        self.deadline = start
+        self.runs = 0
+        self.missed = 0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    def stats(self):
+        """ Returns the timing statistics for this task
+        :return: A dict of run count, missed deadlines and jitter in ms
+        """
+        mean_jitter = self.total_jitter / self.runs if self.runs else 0.0
+        return {
+            "period_ms": round(self.period * 1000, 3),
+            "runs": self.runs,
+            "missed": self.missed,
+            "jitter_ms": round(self.last_jitter * 1000, 3),
+            "mean_jitter_ms": round(mean_jitter * 1000, 3),
+            "max_jitter_ms": round(self.max_jitter * 1000, 3)
+        }
+
+
+def period_from(hz=None, ms=None):
+    """ Converts a rate in Hz or an interval in ms to a period in seconds
+    :param hz: The rate in Hz
+    :param ms: The interval in milliseconds
+    :return: The period in seconds
+    """
+    if (hz is None) == (ms is None):
+        raise ValueError("exactly one of hz or ms must be given")
+    if hz is not None:
+        if hz <= 0:
+            raise ValueError("hz must be positive")
+        return 1.0 / hz
+    if ms <= 0:
+        raise ValueError("ms must be positive")
+    return ms / 1000.0
+
+
+class Scheduler(object):
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.tasks = {}
+        self._heap = []
+
+    def add(self, name, callback, hz=None, ms=None):
+        """ Adds a periodic task, due immediately and then once per period
+        :param name: A unique name for the task
+        :param callback: Called with no arguments when the task is due
+        :param hz: The rate in Hz
+        :param ms: The interval in milliseconds
+        :return: The Task
+        """
+        if name in self.tasks:
+            raise ValueError("duplicate task " + name)
+        task = Task(name, callback, period_from(hz, ms), self.clock())
+        self.tasks[name] = task
+        heapq.heappush(self._heap, (task.deadline, name))
+        return task
+
+    def restart(self):
+        """ Makes every task due now, e.g. once the hardware is ready
+        :return: None
+        """
+        now = self.clock()
+        for task in self.tasks.values():
+            task.deadline = now
+        self._heap = [(now, name) for name in sorted(self.tasks)]
+        heapq.heapify(self._heap)
+
+    def time_until_next(self):
+        """ Returns the number of seconds until the next task is due
+        :return: Seconds until the next deadline, 0 if one is already due, or
+        None if there are no tasks
+        """
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - self.clock())
+
+    def pop_due(self):
+        """ Takes every task whose deadline has arrived and schedules its next
+        deadline, leaving the caller to run them
+        :return: A list of Tasks in deadline order
+        """
+        due = []
+        now = self.clock()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, name = heapq.heappop(self._heap)
+            task = self.tasks[name]
+            jitter = now - deadline
+            task.runs += 1
+            task.last_jitter = jitter
+            task.total_jitter += jitter
+            task.max_jitter = max(task.max_jitter, jitter)
+            # Deadlines that passed entirely while we were late are skipped
+            # rather than run back to back.
+            skipped = int(jitter / task.period)
+            task.missed += skipped
+            task.deadline = deadline + (skipped + 1) * task.period
+            heapq.heappush(self._heap, (task.deadline, name))
+            due.append(task)
+        return due
+
+    def stats(self):
+        """ Returns the timing statistics for every task
+        :return: A dict of task name to statistics
+        """
+        return dict((name, task.stats()) for name, task in self.tasks.items())
@@ -0,0 +1,90 @@
+"""
+Checks that the gateway keeps running while the message broker cannot be
+reached, holding its readings in the outbox until it can be. Runs a simulated
+device against a real MQTT client pointed at a port nothing listens on:
+
+    python -m unittest test_gateway
+"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+try:
+    import thread
+except ImportError:
+    import _thread as thread
+
+import paho.mqtt.client as mqtt
+
+# The simulation must be installed before any device module is imported
+import grovesim
+grovesim.install(grovesim.default_bus(seed=0))
+import gateway
+import grovebus
+import IoTDevice
+import outbox
+
+# Seconds the gateway is run for
+RUN_TIME = 1.5
+
+
+def unused_port():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+
+class UnreachableClient(mqtt.Client):
+    """ A client whose broker refuses every connection """
+
+    def __init__(self):
+        mqtt.Client.__init__(self)
+        self.port = unused_port()
+
+    def connect_async(self, host, port=1883, *args, **kwargs):
+        mqtt.Client.connect_async(self, "127.0.0.1", self.port, *args,
+                                  **kwargs)
+
+
+class GatewayBrokerDownTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "outbox.dat")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_readings_wait_in_outbox(self):
+        queue = outbox.Outbox(self.path)
+        gw = gateway.Gateway("localhost", queue, UnreachableClient())
+        gw.add(IoTDevice.build_device(
+            "test-device", queue,
+            grovebus.BusManager(*grovesim.modules(
+                grovesim.default_bus(seed=1)))))
+        timer = threading.Timer(RUN_TIME, thread.interrupt_main)
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            timer.start()
+            gw.run()
+        finally:
+            timer.cancel()
+            sys.stdout.close()
+            sys.stdout = stdout
+        self.assertFalse(queue.connected)
+        reopened = outbox.Outbox(self.path)
+        try:
+            self.assertTrue(len(reopened) > 0)
+        finally:
+            reopened.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Loads a device's wiring from a config file instead of code. The config maps
+each sensor and actuator name to a GroveDevices class and port, and for sensors
+to a read rate and change filter:
+
+    {
+        "sensors": {
+            "light_sensor": {"class": "LightSensor", "port": "A1", "hz": 2,
+                             "filter": {"absolute": 8, "hysteresis": 4},
+                             "pipeline": [{"type": "ema", "alpha": 0.3}]},
+            "sound_sensor": {"class": "SoundSensor", "port": "A0", "hz": 10,
+                             "aggregate": {"window": 10, "raw": false}},
+            "dht_sensor": {"class": "DHTSensor", "port": "D7", "ms": 2000,
+                           "options": {"dht_type": 1}}
+        },
+        "actuators": {
+            "lcd": {"class": "LCD", "port": "I2C_1",
+                    "options": {"min_interval": 0.2}}
+        }
+    }
+
+Ports are names from the ports module or numbers. Rates are given in "hz" or
+"ms", filters as ChangeFilter arguments, or null to report every change, and
+"options" are passed to the class's constructor. "aggregate" gives
+aggregate.WindowAggregator arguments for sensors that publish window summaries,
+with "raw" saying whether their raw values are published too. "pipeline" lists
+the filters module stages readings are run through before change detection,
+each a "type" from STAGES and its arguments. A "fields" stage maps the fields
+of a sensor that returns a dict to such lists, as does a "pipeline" that is a
+dict rather than a list. "derive" lists the derived.Derive fields, such as the
+dew point, added to a temperature and humidity reading when it is published,
+after change detection. Files ending in .yaml or .yml are read as YAML when
+PyYAML is installed. Every entry is checked when the
+config is built, so wiring mistakes fail at startup rather than on first use.
+"""
+
+import json
+import numbers
+
+import GroveDevices
+import aggregate
+import derived
+import filters
+import ports
+import scheduler
+from changefilter import ChangeFilter
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# The filter stages a pipeline can be made of
+STAGES = {
+    "reject": filters.Reject,
+    "ema": filters.EMA,
+    "kalman": filters.Kalman,
+    "rate_limit": filters.RateLimit,
+    "round": filters.Round,
+    "median": filters.MedianFilter,
+    "fields": None
+}
+
+
+def load(path):
+    """ Reads a topology config file
+    :param path: The JSON or YAML file
+    :return: The config dict
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError("PyYAML is needed to read " + path)
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def _port(name, spec):
+    port = spec.get("port")
+    if isinstance(port, numbers.Integral):
+        return port
+    value = getattr(ports, str(port), None)
+    if not isinstance(value, numbers.Integral):
+        raise ValueError("%s: unknown port %r" % (name, port))
+    return value
+
+
+def _create(name, spec, bus):
+    cls = getattr(GroveDevices, str(spec.get("class")), None)
+    if not (isinstance(cls, type) and
+            issubclass(cls, GroveDevices.GroveDevice)):
+        raise ValueError("%s: unknown class %r" % (name, spec.get("class")))
+    options = dict(spec.get("options") or {})
+    try:
+        return cls(_port(name, spec), bus=bus, **options)
+    except TypeError as e:
+        raise ValueError("%s: %s" % (name, e))
+
+
+def _pipeline(spec):
+    if isinstance(spec, dict):
+        return filters.Fields(**dict((str(field), _pipeline(stages))
+                                     for field, stages in spec.items()))
+    stages = []
+    for stage in spec:
+        options = dict(stage)
+        kind = options.pop("type", None)
+        if kind not in STAGES:
+            raise ValueError("unknown filter stage %r" % kind)
+        if kind == "fields":
+            stages.append(_pipeline(options))
+        else:
+            stages.append(STAGES[kind](**options))
+    return filters.Pipeline(*stages)
+
+
+def build(config, bus=None):
+    """ Creates the sensors and actuators a config describes
+    :param config: The config dict, see load
+    :param bus: The grovebus.BusManager the devices are attached to,
+    GroveDevices.BUS if None
+    :return: A (sensors, actuators, aggregators, derivations) tuple, where
+    sensors is a list of (name, sensor, rate in Hz, change filter) tuples in
+    name order, actuators is a dict of name to GroveDevice, aggregators is a
+    dict of sensor name to aggregate.WindowAggregator and derivations is a
+    dict of sensor name to derived.Derive
+    """
+    sensors = []
+    aggregators = {}
+    derivations = {}
+    for name, spec in sorted((config.get("sensors") or {}).items()):
+        sensor = _create(name, spec, bus)
+        change_filter = spec.get("filter")
+        try:
+            rate = 1.0 / scheduler.period_from(spec.get("hz"), spec.get("ms"))
+            if change_filter is not None:
+                change_filter = ChangeFilter(**change_filter)
+            if spec.get("aggregate") is not None:
+                aggregators[name] = aggregate.WindowAggregator(
+                    **spec["aggregate"])
+            if spec.get("pipeline") is not None:
+                sensor.pipeline = _pipeline(spec["pipeline"])
+            if spec.get("derive") is not None:
+                derivations[name] = derived.Derive(spec["derive"])
+        except (ValueError, TypeError) as e:
+            raise ValueError("%s: %s" % (name, e))
+        sensors.append((name, sensor, rate, change_filter))
+    actuators = {}
+    for name, spec in (config.get("actuators") or {}).items():
+        actuators[name] = _create(name, spec, bus)
+    return sensors, actuators, aggregators, derivations
@@ -1,19 +1,29 @@
 // Convert the payload as follows:
-//   1. Delete all non temperature data points.
-//   2. Convert temp from C to F.
+//   1. Delete all non dew point data points.
+//   2. Use the dew point in C and F calculated on the device, or calculate it
+//      for devices that do not publish it.
 //
 // Sample payload
-// {"timestamp": 1519609945872, "data": {"range": 511, "degrees": 222.0, "temperature": 19.0, "humidity": 47.0}}
+// {"timestamp": 1519609945872, "data": {"range": 511, "degrees": 222.0, "temperature": 19.0, "humidity": 47.0,
+//  "temperature_f": 66.2, "dewpoint_c": 7.4, "dewpoint_f": 45.4, "heat_index_c": 18.2}}
 
-temperature = msg.payload.data.temperature;
-humidity = msg.payload.data.humidity;
+// Some devices publish values as strings, so they are converted to numbers.
+temperature = Number(msg.payload.data.temperature);
+humidity = Number(msg.payload.data.humidity);
+dewpointc = msg.payload.data.dewpoint_c;
+dewpointf = msg.payload.data.dewpoint_f;
 
 for (var key in msg.payload.data) {
     delete msg.payload.data[key];
 }
 
-dewpointc = temperature - ( 100 - humidity ) / 5;
-dewpointf = dewpointc * 9 / 5 + 32;
+if (dewpointc === undefined) {
+    dewpointc = temperature - ( 100 - humidity ) / 5;
+    dewpointf = dewpointc * 9 / 5 + 32;
+} else {
+    dewpointc = Number(dewpointc);
+    dewpointf = Number(dewpointf);
+}
 
 msg.payload.data.dewpoint_c = dewpointc.toFixed(1);
 msg.payload.data.dewpoint_f = dewpointf.toFixed(1);
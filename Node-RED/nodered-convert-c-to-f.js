@@ -1,17 +1,27 @@
 // Convert the payload as follows:
 //   1. Delete all non temperature data points.
-//   2. Convert temp from C to F.
+//   2. Use the temp in F converted on the device, or convert it from C for
+//      devices that do not publish it.
 //
 // Sample payload
-// {"timestamp": 1519609945872, "data": {"range": 511, "degrees": 222.0, "temperature": 19.0, "humidity": 47.0}}
+// {"timestamp": 1519609945872, "data": {"range": 511, "degrees": 222.0, "temperature": 19.0, "humidity": 47.0,
+//  "temperature_f": 66.2, "dewpoint_c": 7.4, "dewpoint_f": 45.4, "heat_index_c": 18.2}}
 
-temperature = msg.payload.data.temperature
+// Some devices publish values as strings, so they are converted to numbers.
+temperature = Number(msg.payload.data.temperature)
+temperaturef = msg.payload.data.temperature_f
 
 for (var key in msg.payload.data) {
     //if (key !== "temperature")
     delete msg.payload.data[key];
 }
 
+if (temperaturef === undefined) {
+    temperaturef = temperature * 9 / 5 + 32;
+} else {
+    temperaturef = Number(temperaturef);
+}
+
 msg.payload.data.temperature_c = temperature.toFixed(1);
-msg.payload.data.temperature_f = (temperature * 9 / 5 + 32).toFixed(1);
+msg.payload.data.temperature_f = temperaturef.toFixed(1);
 return msg;
\ No newline at end of file
@@ -39,25 +39,11 @@
 from grovepi import *
 from grove_rgb_lcd import *
 from time import sleep
-from math import isnan
 import paho.mqtt.client as mqtt
 import json
 import grovepi
-
-# Define a class NanError derived from super class Exception for use in raising Nan errors.
-
-
-class NanError(Exception):
-    pass
-
-
-# Define a class ZeroError derived from super class Exception for use in raising errors when
-# temp/humidity both return 0.
-
-
-class ZeroError(Exception):
-    pass
-
+import filters
+import derived
 
 # Set to True to see debug statements like nan error, False to hide.
 debug = False
@@ -65,6 +51,16 @@ debug = False
 # Setup DHT sensor.
 dht_sensor_port = 7     # connect the DHt sensor to port 7
 dht_sensor_type = 0     # use 0 for the blue-colored sensor and 1 for the white-colored sensor
+# Drop nan readings, and the zero humidity of a read that returned zero for both values,
+# then smooth what is left.
+dht_filter = filters.Pipeline(
+    filters.Fields(temperature=filters.Reject(), humidity=filters.Reject(zero=True)),
+    filters.Fields(temperature=filters.Pipeline(filters.Kalman(0.01, 0.5), filters.Round(1)),
+                   humidity=filters.Pipeline(filters.Kalman(0.05, 2.0), filters.Round(1))))
+
+# Fields derived from the temperature and humidity and published with them, so
+# subscribers need not compute them from every message.
+derive = derived.Derive(["temperature_f", "dewpoint_c", "dewpoint_f", "heat_index_c"])
 
 scale = 'F'         # Scale for temperature, C or F.
 symbol = u'\u2103'  # Unicode degrees C.
@@ -99,27 +95,16 @@ try:
         # Read sensor value from potentiometer
         angle_sensor = grovepi.analogRead(potentiometer)
 
-        # DHT in it's own try except to handle nan errors.
-        try:
-            # get the temperature and Humidity from the DHT sensor
-            [tempc, hum] = dht(dht_sensor_port, dht_sensor_type)
-
-            # check if we have nans
-            # if so, then raise a locally defined NanError exception
-            if isnan(tempc) is True or isnan(hum) is True:
-                raise NanError('nan error')
-
-            # Check if both temp and humidity are zero
-            # if so, the raise a locally defined ZeroError exception
-            if tempc == 0.0 and hum == 0.0:
-                raise ZeroError('zero error')
-
-        except (NanError, ZeroError) as e:
+        # get the temperature and Humidity from the DHT sensor
+        [tempc, hum] = dht(dht_sensor_port, dht_sensor_type)
+        reading = dht_filter.process({"temperature": tempc, "humidity": hum})
+        if reading is None:
             if debug:
-                print str(e)
+                print 'dht error', tempc, hum
             # Do nothing and retry after short delay.
             sleep(0.25)
             continue
+        tempc, hum = reading["temperature"], reading["humidity"]
 
         if tempc <= 5:
             setRGB(0, 0, 255)
@@ -131,7 +116,7 @@ try:
         print '\nTemp:', str(tempc) + u'\u2103'  # Unicode degrees C.
 
         if scale == 'F':
-            temp = tempc * 9 / 5 + 32
+            temp = round(derived.fahrenheit(tempc), 1)
             symbol = u'\u2109'  # Unicode degrees F.
             print 'Temp:', str(temp) + symbol
         else:
@@ -164,7 +149,7 @@ try:
         # local_client.publish('SNHU/IT697/sensor/data', 'Ranger: ' + str(ranger))
         # local_client.publish('SNHU/IT697/sensor/data', 'Degrees: ' + str(degrees))
         publish_data = {"timestamp": int(time.time() * 1000),
-                        "data": {"temperature": tempc, "humidity": hum, "range": ranger, "degrees": degrees}}
+                        "data": derive.process({"temperature": tempc, "humidity": hum, "range": ranger, "degrees": degrees})}
         local_client.publish('SNHU/IT697/sensor/data/json', json.dumps(publish_data))
         # remote_client.publish('SNHU/IT697/jeffrey_cutter_snhu_edu/sensor/data/json', json.dumps(publish_data))
 
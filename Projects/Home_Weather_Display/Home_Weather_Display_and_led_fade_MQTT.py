@@ -40,24 +40,12 @@ import paho.mqtt.client as mqtt
 import json
 import grovepi
 import grove_rgb_lcd
-import math
+import threading
 import time
 import uuidgen
-
-# Define a class NanError derived from super class Exception for use in raising Nan errors.
-
-
-class NanError(Exception):
-    pass
-
-
-# Define a class ZeroError derived from super class Exception for use in raising errors when
-# temp/humidity both return 0.
-
-
-class ZeroError(Exception):
-    pass
-
+import filters
+import derived
+import ledfade
 
 # Set to True to see debug statements like nan error, False to hide.
 debug = False
@@ -67,6 +55,16 @@ uuid = uuidgen.generateUuid()
 # Setup DHT sensor.
 dht_sensor_port = 7     # connect the DHt sensor to port 7
 dht_sensor_type = 0     # use 0 for the blue-colored sensor and 1 for the white-colored sensor
+# Drop nan readings, and the zero humidity of a read that returned zero for both values,
+# then smooth what is left so noise does not count as a change.
+dht_filter = filters.Pipeline(
+    filters.Fields(temperature=filters.Reject(), humidity=filters.Reject(zero=True)),
+    filters.Fields(temperature=filters.Pipeline(filters.Kalman(0.01, 0.5), filters.Round(1)),
+                   humidity=filters.Pipeline(filters.Kalman(0.05, 2.0), filters.Round(1))))
+
+# Fields derived from the temperature and humidity and published with them, so
+# subscribers need not compute them from every message.
+derive = derived.Derive(["temperature_f", "dewpoint_c", "dewpoint_f", "heat_index_c"])
 
 scale = 'F'         # Scale for temperature, C or F.
 symbol = u'\u2103'  # Unicode degrees C.
@@ -81,6 +79,15 @@ grovepi.pinMode(RED_LED, "OUTPUT")
 grovepi.pinMode(GREEN_LED, "OUTPUT")
 grovepi.pinMode(BLUE_LED, "OUTPUT")
 
+# The GrovePi is shared by this loop and the LED fader's thread, and an I2C
+# transaction must not be interleaved with another, so every call holds this.
+i2c_lock = threading.Lock()
+
+# LED commands set targets that the fader moves toward at a fixed frame rate,
+# so a burst of commands costs no more I2C writes than one.
+fader = ledfade.LedFader(grovepi.analogWrite, {"red": RED_LED, "green": GREEN_LED, "blue": BLUE_LED},
+                         fps=30, fade_time=0.5, lock=i2c_lock)
+
 # Setup Rotary Angle Sensor
 potentiometer = 0   # Connect the Grove Rotary Angle Sensor to analog port A0
 grovepi.pinMode(potentiometer, 'INPUT')
@@ -91,6 +98,9 @@ full_angle = 300    # Full value of the rotary angle is 300 degrees, as per it's
 
 # Setup Ultrasonic Ranger
 ultrasonic_ranger = 8
+# Drop spikes, timeouts and out of range echoes; the ranger reads 2-400 cm.
+ranger_filter = filters.MedianFilter(window=5, minimum=2, maximum=400, max_deviation=50)
+ranger = None
 
 
 def valid_led_value(payload, color):
@@ -125,14 +135,18 @@ def on_message(client, userdata, msg):
     :return: None
     """
     print msg.topic, msg.payload
-    payload = json.loads(msg.payload)
+    try:
+        payload = json.loads(msg.payload)
+    except ValueError:
+        return
+    if not isinstance(payload, dict):
+        return
     #print "payload: " + str(payload)
-    if valid_led_value(payload, 'red'):
-        grovepi.analogWrite(RED_LED, payload['red'])
-    if valid_led_value(payload, 'green'):
-        grovepi.analogWrite(GREEN_LED, payload['green'])
-    if valid_led_value(payload, 'blue'):
-        grovepi.analogWrite(BLUE_LED, payload['blue'])
+    # Only the targets are set here; the fader's thread does the I2C writes so
+    # the network thread is never blocked on the bus.
+    for color in ('red', 'green', 'blue'):
+        if valid_led_value(payload, color):
+            fader.set(color, payload[color])
 
 
 # Initialize MQTT connections.
@@ -141,59 +155,81 @@ local_client.loop_start()
 local_client.on_connect = on_connect
 local_client.on_message = on_message
 local_client.connect("localhost")
+fader.start()
 # local_client.loop_forever()
 # remote_client = mqtt.Client()
 # remote_client.connect('test.mosquitto.org')
 # remote_client.loop_start()
 
 
-try:
-    while True:
-        # Read Ultrasonic Ranger
-        ranger = grovepi.ultrasonicRead(ultrasonic_ranger)
+# The loop runs every MIN_CYCLE seconds while readings are changing and backs
+# off to MAX_CYCLE seconds while they are not.
+MIN_CYCLE = 0.5
+MAX_CYCLE = 10.0
+# Smallest change in each reading that counts as a change
+THRESHOLDS = {"temperature": 0.5, "humidity": 1.0, "range": 2, "degrees": 1.5,
+              "red": 2, "blue": 2}
+# The DHT is read at most once a DHT_INTERVAL seconds. After a NaN or zero
+# reading it is retried after DHT_BACKOFF seconds, doubling up to MAX_CYCLE.
+DHT_INTERVAL = 1.0
+DHT_BACKOFF = 0.25
+
+
+def changed_readings(readings, last):
+    """Returns the names of the readings that moved by at least their threshold
+    :param readings: The current readings, None where there is no reading
+    :param last: The readings last sent
+    :return: A list of reading names
+    """
+    changed = []
+    for name, value in readings.items():
+        if value is None:
+            continue
+        if last.get(name) is None or abs(value - last[name]) >= THRESHOLDS[name]:
+            changed.append(name)
+    return changed
 
-        # Read sensor value from potentiometer
-        angle_sensor = grovepi.analogRead(potentiometer)
 
-        # DHT in it's own try except to handle nan errors.
-        try:
-            # get the temperature and Humidity from the DHT sensor
-            [tempc, hum] = grovepi.dht(dht_sensor_port, dht_sensor_type)
-
-            # check if we have nans
-            # if so, then raise a locally defined NanError exception
-            if math.isnan(tempc) is True or math.isnan(hum) is True:
-                raise NanError('nan error')
-
-            # Check if both temp and humidity are zero
-            # if so, the raise a locally defined ZeroError exception
-            if tempc == 0.0 and hum == 0.0:
-                raise ZeroError('zero error')
-
-        except (NanError, ZeroError) as e:
-            if debug:
-                print str(e)
-            # Do nothing and retry after short delay.
-            time.sleep(0.25)
-            continue
+cycle = MIN_CYCLE
+tempc = hum = None
+dht_next = 0
+dht_backoff = DHT_BACKOFF
+last_readings = {}
+last_leds = {}
+last_rgb = None
+last_text = None
 
-        if tempc <= 5:
-            grove_rgb_lcd.setRGB(0, 0, 255)
-        elif 5 < tempc < 20:
-            grove_rgb_lcd.setRGB(0, 255, 0)
-        else:
-            grove_rgb_lcd.setRGB(255, 0, 0)
+try:
+    while True:
+        now = time.time()
 
-        print '\nTemp:', str(tempc) + u'\u2103'  # Unicode degrees C.
+        # Read Ultrasonic Ranger, keeping the last good range if this echo is rejected
+        with i2c_lock:
+            raw_range = grovepi.ultrasonicRead(ultrasonic_ranger)
+        filtered = ranger_filter.process(raw_range)
+        if filtered is not None:
+            ranger = filtered
 
-        if scale == 'F':
-            temp = tempc * 9 / 5 + 32
-            symbol = u'\u2109'  # Unicode degrees F.
-            print 'Temp:', str(temp) + symbol
-        else:
-            temp = tempc
+        # Read sensor value from potentiometer
+        with i2c_lock:
+            angle_sensor = grovepi.analogRead(potentiometer)
 
-        print 'Humi:', str(hum) + '%'
+        # A failed DHT read keeps the last good values and is retried with a
+        # growing delay.
+        if now >= dht_next:
+            # get the temperature and Humidity from the DHT sensor
+            with i2c_lock:
+                [new_tempc, new_hum] = grovepi.dht(dht_sensor_port, dht_sensor_type)
+            reading = dht_filter.process({"temperature": new_tempc, "humidity": new_hum})
+            if reading is not None:
+                tempc, hum = reading["temperature"], reading["humidity"]
+                dht_next = now + DHT_INTERVAL
+                dht_backoff = DHT_BACKOFF
+            else:
+                if debug:
+                    print "dht error", new_tempc, new_hum, "retrying in", dht_backoff
+                dht_next = now + dht_backoff
+                dht_backoff = min(dht_backoff * 2, MAX_CYCLE)
 
         # Calculate voltage
         voltage = round(float(angle_sensor) * adc_ref / 1023, 2)
@@ -204,44 +240,77 @@ try:
         # Calculate LED brightess (0 to 255) from degrees (0 to 300)
         brightness = int(degrees / full_angle * 255)
 
-        # Give PWM output to LED
-        # grovepi.analogWrite(BLUE_LED, brightness)
-
-        # Send PWM output to LED via MQTT.
-        publish_data = {"blue": brightness}
-        local_client.publish('SNHU/IT697/leds-Node-RED', json.dumps(publish_data))
-
-        print "Ranger:", ranger
-        # Send PWM output to LED via MQTT
-        if ranger > 255:
-            led_ranger = 255
+        # Send PWM output to the LEDs via MQTT, in one message and only when it
+        # changes.
+        leds = {"blue": brightness}
+        if ranger is not None:
+            leds["red"] = min(ranger, 255)
+        if changed_readings(leds, last_leds):
+            local_client.publish('SNHU/IT697/leds-Node-RED', json.dumps(leds))
+            last_leds = leds
+
+        if tempc is not None:
+            if scale == 'F':
+                temp = round(derived.fahrenheit(tempc), 1)
+                symbol = u'\u2109'  # Unicode degrees F.
+            else:
+                temp = tempc
+
+            if tempc <= 5:
+                rgb = (0, 0, 255)
+            elif 5 < tempc < 20:
+                rgb = (0, 255, 0)
+            else:
+                rgb = (255, 0, 0)
+
+            # The display is only written when what it shows changes
+            if rgb != last_rgb:
+                with i2c_lock:
+                    grove_rgb_lcd.setRGB(*rgb)
+                last_rgb = rgb
+
+            # instead of inserting a bunch of whitespace, we can just insert a \n
+            # we're ensuring that if we get some strange strings on one line, the 2nd one won't be affected
+            text = "Temp: " + str(temp) + scale + '\n' + "Humidity: " + str(hum) + '%'
+            if text != last_text:
+                with i2c_lock:
+                    grove_rgb_lcd.setText_norefresh(text)
+                last_text = text
+
+        readings = {"temperature": tempc, "humidity": hum, "range": ranger, "degrees": degrees}
+        changed = changed_readings(readings, last_readings)
+        if changed:
+            if tempc is not None:
+                print '\nTemp:', str(tempc) + u'\u2103'  # Unicode degrees C.
+                if scale == 'F':
+                    print 'Temp:', str(temp) + symbol
+                print 'Humi:', str(hum) + '%'
+            print "Ranger:", ranger
+            print("Angle: %d, Voltage: %.2f, degrees: %.1f, brightness: %d" % (angle_sensor, voltage, degrees, brightness))
+
+            # Publish to MQTT.
+            # Readings not taken yet, such as before the first good DHT read, are left out.
+            data = dict((name, value) for name, value in readings.items() if value is not None)
+            publish_data = {"timestamp": int(time.time() * 1000), "data": derive.process(data)}
+            local_client.publish('SNHU/IT697/sensor/data/' + uuid, json.dumps(publish_data))
+            last_readings = readings
+
+            # Readings are moving, so look again soon.
+            cycle = MIN_CYCLE
+        elif ranger_filter.outliers:
+            # The range may be changing, look again soon to confirm it.
+            cycle = MIN_CYCLE
         else:
-            led_ranger = ranger
-
-        publish_data = {"red": led_ranger}
-        local_client.publish('SNHU/IT697/leds-Node-RED', json.dumps(publish_data))
-
-        print("Angle: %d, Voltage: %.2f, degrees: %.1f, brightness: %d" % (angle_sensor, voltage, degrees, brightness))
-
-        # instead of inserting a bunch of whitespace, we can just insert a \n
-        # we're ensuring that if we get some strange strings on one line, the 2nd one won't be affected
-        grove_rgb_lcd.setText_norefresh("Temp: " + str(temp) + scale + '\n' + "Humidity: " + str(hum) + '%')
-
-        # Publish to MQTT.
-        # local_client.publish('SNHU/IT697/sensor/data', 'Temp: ' + str(temp) + scale + ', Humi: ' + str(hum) + '%')
-        # local_client.publish('SNHU/IT697/sensor/data', 'Ranger: ' + str(ranger))
-        # local_client.publish('SNHU/IT697/sensor/data', 'Degrees: ' + str(degrees))
-        publish_data = {"timestamp": int(time.time() * 1000),
-                        "data": {"temperature": tempc, "humidity": hum, "range": ranger, "degrees": degrees}}
-        #local_client.publish('SNHU/IT697/sensor/data/json', json.dumps(publish_data))
-        local_client.publish('SNHU/IT697/sensor/data/' + uuid, json.dumps(publish_data))
-        # remote_client.publish('SNHU/IT697/jeffrey_cutter_snhu_edu/sensor/data/json', json.dumps(publish_data))
+            cycle = min(cycle * 2, MAX_CYCLE)
 
-        # Delay between updates.
-        time.sleep(10)
+        # Delay between updates, waking early to retry a failed DHT read.
+        delay = cycle
+        if dht_backoff > DHT_BACKOFF:
+            delay = min(delay, max(0, dht_next - time.time()))
+        time.sleep(delay)
 
         # Keep line spacing consistent in debug mode.
-        if debug:
+        if debug and changed:
             print
 
 except KeyboardInterrupt as e:
@@ -249,6 +318,8 @@ except KeyboardInterrupt as e:
         print type(e)
 
 finally:
+    # Stop the fader first so it cannot write over the LEDs once they are off.
+    fader.stop()
     print "Turning display off"
     grove_rgb_lcd.setText('')
     grove_rgb_lcd.setRGB(0, 0, 0)
@@ -0,0 +1,95 @@
+"""
+A fixed frame rate fade engine for PWM LEDs. Commands only set targets, and
+a newer target replaces an older one that has not been reached yet. A
+background thread moves each LED a bounded step toward its target once per
+frame and writes only the LEDs whose level changed, so the number of I2C writes
+per frame is bounded by the number of LEDs however fast commands arrive.
+"""
+
+import threading
+import time
+
+
+class LedFader(object):
+    def __init__(self, write, ports, fps=30, fade_time=0.5, lock=None,
+                 clock=time.time, sleep=time.sleep):
+        """
+        :param write: Called with (port, level) to set an LED, e.g.
+        grovepi.analogWrite
+        :param ports: A dict of LED name to port
+        :param fps: Frames per second
+        :param fade_time: Seconds a fade across the full 0-255 range takes
+        :param lock: A lock held around each write, shared with any other
+        code using the bus, or None
+        """
+        self.write = write
+        self.ports = ports
+        self.frame_time = 1.0 / fps
+        # The most an LED moves in one frame
+        self.step = max(1, int(round(255 * self.frame_time / fade_time)))
+        self.lock = lock or threading.Lock()
+        self.clock = clock
+        self.sleep = sleep
+        self.levels = dict((name, 0) for name in ports)
+        self.targets = dict(self.levels)
+        self.targets_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def set(self, name, level):
+        """ Sets the level an LED fades to. Safe to call from any thread.
+        :param name: The LED name
+        :param level: The target level, 0-255
+        :return: None
+        """
+        with self.targets_lock:
+            self.targets[name] = max(0, min(255, int(level)))
+
+    def frame(self):
+        """ Moves every LED one step toward its target
+        :return: The number of LEDs written
+        """
+        with self.targets_lock:
+            targets = dict(self.targets)
+        written = 0
+        for name, target in targets.items():
+            level = self.levels[name]
+            if level == target:
+                continue
+            if level < target:
+                level = min(target, level + self.step)
+            else:
+                level = max(target, level - self.step)
+            with self.lock:
+                self.write(self.ports[name], level)
+            self.levels[name] = level
+            written += 1
+        return written
+
+    def run(self):
+        next_frame = self.clock()
+        while not self.stopping.is_set():
+            try:
+                self.frame()
+            except IOError as e:
+                print("Error", e)
+            # Frames are scheduled from a fixed start so they do not drift,
+            # and skipped rather than run back to back after an overrun.
+            next_frame += self.frame_time
+            delay = next_frame - self.clock()
+            if delay < 0:
+                next_frame = self.clock()
+                delay = 0
+            self.sleep(delay)
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="led-fader")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -1,5 +1,76 @@
+"""
+Generates UUIDs in a consistent manner. Generated UUIDs are cached in a small
+state file next to this module, so after the first run a device's UUID is known
+without querying the network interfaces at all.
+"""
+
+import json
+import os
 import uuid
-import netifaces
-def generateUuid(name='', domain='.snhu.edu'):
-    mac = netifaces.ifaddresses('eth0')[netifaces.AF_LINK][0]['addr'].encode('utf-8')
-    return str(uuid.uuid5(uuid.NAMESPACE_DNS, mac+'.'+name+domain))
\ No newline at end of file
+
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'device_uuid.json')
+# Interfaces whose MAC address is preferred, in order. Any other interface with
+# a MAC address is used if none of these exist.
+INTERFACES = ('eth0', 'wlan0')
+
+
+def _mac():
+    """ Returns the MAC address the device is identified by """
+    try:
+        import netifaces
+    except ImportError:
+        netifaces = None
+    if netifaces is not None:
+        interfaces = netifaces.interfaces()
+        for name in list(INTERFACES) + sorted(interfaces):
+            if name not in interfaces or name == 'lo':
+                continue
+            link = netifaces.ifaddresses(name).get(netifaces.AF_LINK)
+            if link and link[0].get('addr') and \
+                    link[0]['addr'] != '00:00:00:00:00:00':
+                return link[0]['addr']
+    # Last resort, the MAC address as the uuid module finds it
+    return ':'.join('%02x' % ((uuid.getnode() >> shift) & 0xff)
+                    for shift in range(40, -1, -8))
+
+
+def _load(state_file):
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save(state_file, state):
+    # Written to a temporary file first so a crash never leaves it truncated
+    try:
+        with open(state_file + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.rename(state_file + '.tmp', state_file)
+    except (IOError, OSError):
+        pass
+
+
+def generateUuid(namespace='', domain='snhu.edu', state_file=STATE_FILE):
+    """ Generate a device specific Type 5 UUID within a namespace and domain.
+
+    :param namespace: The namespace where the UUID is being generated
+    :param domain: The domain where the UUID is being generated
+    :param state_file: The file generated UUIDs are cached in, or None not to
+    cache them
+    :return: Type 5 UUID
+    """
+    key = namespace + '.' + domain
+    state = _load(state_file) if state_file else {}
+    try:
+        return str(state[key])
+    except KeyError:
+        pass
+    mac = _mac().encode('utf-8')
+    generated = str(uuid.uuid5(uuid.NAMESPACE_DNS, mac+'.'+namespace+'.'+domain))
+    if state_file:
+        state[key] = generated
+        _save(state_file, state)
+    return generated